@@ -0,0 +1,103 @@
+import frappe
+from werkzeug.wrappers import Response
+
+from payment_tracking.sc_payment.instrumentation import get_prometheus_text, instrumented
+from payment_tracking.sc_payment.metrics import get_counters, reset_counters
+
+# Counters each stats endpoint reports (and clears with reset=1)
+SCHEDULE_CACHE_COUNTERS = ("schedule_cache_hits", "schedule_cache_misses")
+DEADLOCK_COUNTERS = ("deadlock_retries", "deadlock_giveups")
+ORDER_LOCK_COUNTERS = (
+    "order_locks_acquired",
+    "order_locks_contended",
+    "order_lock_timeouts",
+    "order_lock_wait_seconds",
+)
+
+
+@frappe.whitelist()
+@instrumented
+def get_schedule_cache_stats(reset=False):
+    """
+    Payment Schedule cache hits and misses summed over all requests/jobs
+    since the counters were last reset (System Manager only).
+    Pass reset=1 to start a new measurement window.
+    """
+    frappe.only_for("System Manager")
+
+    counters = get_counters()
+    if frappe.utils.cint(reset):
+        reset_counters(SCHEDULE_CACHE_COUNTERS)
+
+    hits = counters.get("schedule_cache_hits", 0)
+    misses = counters.get("schedule_cache_misses", 0)
+    lookups = hits + misses
+
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / lookups, 4) if lookups else None,
+    }
+
+
+@frappe.whitelist()
+@instrumented
+def get_deadlock_stats(reset=False):
+    """
+    Deadlock / lock-wait timeout retries per unit of work and the number of
+    units that gave up after the last attempt (System Manager only).
+    Pass reset=1 to clear these counters.
+    """
+    frappe.only_for("System Manager")
+
+    counters = get_counters()
+    prefix = "deadlock_retries:"
+    if frappe.utils.cint(reset):
+        reset_counters([*DEADLOCK_COUNTERS, *(name for name in counters if name.startswith(prefix))])
+
+    return {
+        "retries": counters.get("deadlock_retries", 0),
+        "giveups": counters.get("deadlock_giveups", 0),
+        "retries_by_label": {
+            name[len(prefix):]: value for name, value in counters.items() if name.startswith(prefix)
+        },
+    }
+
+
+@frappe.whitelist()
+@instrumented
+def get_order_lock_stats(reset=False):
+    """
+    Per-Order advisory lock acquisitions, contended acquisitions, total wait
+    and timeouts (System Manager only). Pass reset=1 to clear these counters.
+    """
+    frappe.only_for("System Manager")
+
+    counters = get_counters()
+    if frappe.utils.cint(reset):
+        reset_counters(ORDER_LOCK_COUNTERS)
+
+    contended = counters.get("order_locks_contended", 0)
+    wait_seconds = counters.get("order_lock_wait_seconds", 0)
+
+    return {
+        "acquired": counters.get("order_locks_acquired", 0),
+        "contended": contended,
+        "timeouts": counters.get("order_lock_timeouts", 0),
+        "wait_seconds": round(wait_seconds, 3),
+        "avg_wait_seconds": round(wait_seconds / contended, 3) if contended else None,
+    }
+
+
+@frappe.whitelist()
+@instrumented
+def get_instrumentation_metrics():
+    """
+    Rolling wall time, SQL query count and SQL time histograms of the app's
+    hooks and APIs in Prometheus text format (System Manager only, e.g. an
+    API key in the scrape config). Empty unless site config
+    `payment_tracking_instrumentation` is set.
+    """
+    frappe.only_for("System Manager")
+
+    return Response(get_prometheus_text(), mimetype="text/plain; version=0.0.4")
@@ -1,83 +1,77 @@
 import frappe
 
+from payment_tracking.sc_payment import document_links, party_names
+from payment_tracking.sc_payment.bulk_payment_entries import BULK_SUBMIT_CHUNK_SIZE, submit_payment_entries
+from payment_tracking.sc_payment.instrumentation import instrumented
+
+
 @frappe.whitelist()
+@instrumented
 def get_connected_orders_for_payment_entry(payment_entry_name):
     """
     Get connected Purchase Orders and Sales Orders for a Payment Entry
     through linked invoices.
     """
     try:
-        # Get the Payment Entry document
-        payment_entry = frappe.get_doc("Payment Entry", payment_entry_name)
-
-        connected_orders = []
-
-        # Process each reference in the Payment Entry
-        for ref in payment_entry.references:
-            if ref.reference_doctype == "Sales Invoice":
-                # Get Sales Orders linked to this Sales Invoice
-                sales_orders = frappe.db.sql("""
-                    SELECT DISTINCT si_item.sales_order
-                    FROM `tabSales Invoice Item` si_item
-                    WHERE si_item.parent = %s
-                    AND si_item.sales_order IS NOT NULL
-                    AND si_item.sales_order != ''
-                """, (ref.reference_name,), as_dict=True)
-
-                for order in sales_orders:
-                    if order.sales_order:
-                        connected_orders.append({
-                            "reference_doctype": "Sales Order",
-                            "reference_name": order.sales_order
-                        })
-
-            elif ref.reference_doctype == "Purchase Invoice":
-                # Get Purchase Orders linked to this Purchase Invoice
-                purchase_orders = frappe.db.sql("""
-                    SELECT DISTINCT pi_item.purchase_order
-                    FROM `tabPurchase Invoice Item` pi_item
-                    WHERE pi_item.parent = %s
-                    AND pi_item.purchase_order IS NOT NULL
-                    AND pi_item.purchase_order != ''
-                """, (ref.reference_name,), as_dict=True)
-
-                for order in purchase_orders:
-                    if order.purchase_order:
-                        connected_orders.append({
-                            "reference_doctype": "Purchase Order",
-                            "reference_name": order.purchase_order
-                        })
-
-        # Remove duplicates
-        unique_orders = []
-        seen = set()
-        for order in connected_orders:
-            key = f"{order['reference_doctype']}::{order['reference_name']}"
-            if key not in seen:
-                seen.add(key)
-                unique_orders.append(order)
-
-        return unique_orders
+        return document_links.get_invoice_orders(payment_entry_name)
 
     except Exception as e:
         frappe.log_error(f"Error in get_connected_orders_for_payment_entry: {e!s}")
         return []
 
 @frappe.whitelist()
+@instrumented
 def get_party_name(party_type, party_id):
     """
     Get party name safely
     """
     try:
-        if party_type == "Customer":
-            result = frappe.db.get_value("Customer", party_id, "customer_name")
-        elif party_type == "Supplier":
-            result = frappe.db.get_value("Supplier", party_id, "supplier_name")
-        else:
-            return party_id
-
-        return result if result else party_id
+        return party_names.get_party_name(party_type, party_id)
 
     except Exception as e:
         frappe.log_error(f"Error in get_party_name: {e!s}")
         return party_id
+
+
+@frappe.whitelist()
+@instrumented
+def get_document_links(doctype, name, party_type=None, party=None):
+    """
+    Everything the Document Links field shows for a Payment Entry or Invoice in one call:
+    party name, direct and indirect Orders, Invoices and Payment Requests.
+    party_type / party: current (possibly unsaved) values from the form.
+    """
+    if frappe.db.exists(doctype, name):
+        frappe.has_permission(doctype, "read", doc=name, throw=True)
+    else:
+        # Unsaved form (e.g. a new Purchase Invoice): only the party name is resolved
+        frappe.has_permission(doctype, "read", throw=True)
+
+    return document_links.get_document_links(doctype, name, party_type=party_type, party=party)
+
+
+@frappe.whitelist()
+@instrumented
+def get_party_names_batch(parties):
+    """
+    Display names for many parties in one call.
+    parties: list / JSON list of [party_type, party] pairs
+    Returns: {"<party_type>::<party>": name}
+    """
+    names = party_names.get_party_names(tuple(party) for party in frappe.parse_json(parties) or [])
+    return {f"{party_type}::{party}": name for (party_type, party), name in names.items()}
+
+
+@frappe.whitelist(methods=["POST"])
+@instrumented
+def bulk_submit_payment_entries(names, chunk_size=BULK_SUBMIT_CHUNK_SIZE):
+    """
+    Submit many draft Payment Entries, one transaction per chunk_size entries (0 = all in one).
+    Payment Schedule updates are aggregated per row and payment totals recomputed once per
+    affected document per chunk; a failing entry is rolled back alone.
+    names: list / JSON list of Payment Entry names
+    Returns: {total, submitted, failed, failures: [{name, error}], chunks, elapsed_seconds, entries_per_sec}
+    """
+    frappe.has_permission("Payment Entry", "submit", throw=True)
+
+    return submit_payment_entries(frappe.parse_json(names) or [], chunk_size=chunk_size)
@@ -1,71 +1,61 @@
 import frappe
 from frappe import _
 
+from payment_tracking.sc_payment import payment_request_availability, schedule_documents
+from payment_tracking.sc_payment.instrumentation import instrumented
+from payment_tracking.sc_payment.schedule_links import link_schedule_row, unlink_schedule_rows
+
 
 @frappe.whitelist()
+@instrumented
 def can_create_payment_request(purchase_order, payment_amount):
     """
     Validate if Payment Request can be created (ERPNext standard logic)
+    Reads only the Purchase Order amount columns instead of loading the whole document.
     Returns: {can_create: bool, error_message: str}
     """
-    po = frappe.get_doc("Purchase Order", purchase_order)
-    payment_amount = float(payment_amount)
-
-    # Calculate available amount (same as ERPNext)
-    grand_total = po.rounded_total or po.grand_total
-    advance_paid = po.advance_paid or 0
-    available_amount = grand_total - advance_paid
-
-    # If already fully paid
-    if available_amount <= 0:
-        return {
-            "can_create": False,
-            "error_message": _("Payment Entry is already created")
-        }
-
-    # Get existing Payment Request amount (all submitted PRs)
-    existing_pr_amount = get_existing_payment_request_amount(po)
-
-    # Calculate remaining amount after existing PRs
-    remaining_amount = available_amount - existing_pr_amount
-
-    if remaining_amount <= 0:
-        return {
-            "can_create": False,
-            "error_message": _("Payment Request is already created")
-        }
-
-    # Check if new PR amount would exceed available
-    if payment_amount > remaining_amount:
-        return {
-            "can_create": False,
-            "error_message": _("Payment Request amount ({0}) exceeds available amount ({1})").format(
-                frappe.format_value(payment_amount, {"fieldtype": "Currency"}),
-                frappe.format_value(remaining_amount, {"fieldtype": "Currency"})
-            )
-        }
+    frappe.has_permission("Purchase Order", "read", throw=True)
 
-    return {"can_create": True}
+    return payment_request_availability.can_create_payment_request("Purchase Order", purchase_order, payment_amount)
 
 
-def get_existing_payment_request_amount(purchase_order_doc):
-    """Get total amount of all submitted Payment Requests against Purchase Order"""
-    from frappe.query_builder import DocType
-    from frappe.query_builder.functions import Sum
+@frappe.whitelist()
+@instrumented
+def get_payment_schedule_availability(purchase_orders):
+    """
+    Availability of every Payment Schedule row of one or more Purchase Orders in one call.
+    purchase_orders: name or list / JSON list of names.
+    Returns: {purchase_order: [{name, idx, action, can_create, error_message, ...}]}
+    """
+    frappe.has_permission("Purchase Order", "read", throw=True)
+
+    if isinstance(purchase_orders, str) and not purchase_orders.startswith("["):
+        purchase_orders = [purchase_orders]
+
+    return payment_request_availability.get_schedule_availability("Purchase Order", frappe.parse_json(purchase_orders))
 
-    PR = DocType("Payment Request")
 
-    result = (
-        frappe.qb.from_(PR)
-        .select(Sum(PR.grand_total))
-        .where(PR.reference_doctype == "Purchase Order")
-        .where(PR.reference_name == purchase_order_doc.name)
-        .where(PR.docstatus == 1)  # Only submitted
-    ).run()
+@frappe.whitelist(methods=["POST"])
+@instrumented
+def create_from_schedule_row(purchase_order, row_idx):
+    """
+    Validate, create and link a draft Payment Request (advance rows) or
+    Purchase Invoice (last row) for one Payment Schedule row in one transaction.
+    Returns: {doctype, name} of the new document
+    """
+    frappe.has_permission("Purchase Order", "read", doc=purchase_order, throw=True)
+
+    return schedule_documents.create_from_schedule_row("Purchase Order", purchase_order, row_idx)
 
-    return result[0][0] or 0
 
+def get_existing_payment_request_amount(purchase_order_doc):
+    """Get total amount of all submitted Payment Requests against Purchase Order"""
+    return payment_request_availability.get_payment_requested_amounts(
+        "Purchase Order", [purchase_order_doc.name]
+    ).get(purchase_order_doc.name, 0)
 
+
+@instrumented
 def link_payment_request_to_schedule(doc, method=None):
     """
     Link Payment Request back to Payment Schedule after it's created.
@@ -79,22 +69,16 @@ def link_payment_request_to_schedule(doc, method=None):
     if not hasattr(doc, 'payment_term_pos') or not doc.payment_term_pos:
         return
 
+    # Already linked by create_from_schedule_row
+    if doc.flags.payment_tracking_schedule_linked:
+        return
+
     try:
-        # Get the Purchase Order
-        po = frappe.get_doc("Purchase Order", doc.reference_name)
-
-        # Find the payment schedule row by payment_term_pos (idx)
-        for schedule_row in po.payment_schedule:
-            if schedule_row.idx == doc.payment_term_pos:
-                # Update the custom fields
-                schedule_row.custom_invoice_doctype = "Payment Request"
-                schedule_row.custom_invoice_name = doc.name
-                break
-
-        # Save the Purchase Order (ignore permissions to allow system update)
-        po.flags.ignore_validate_update_after_submit = True
-        po.flags.ignore_permissions = True
-        po.save()
+        # Lock and update only the payment schedule row at payment_term_pos (idx)
+        if not link_schedule_row(
+            "Purchase Order", doc.reference_name, "Payment Request", doc.name, idx=doc.payment_term_pos
+        ):
+            return
 
         frappe.msgprint(
             _("Payment Request {0} linked to Payment Schedule row {1}").format(
@@ -110,12 +94,17 @@ def link_payment_request_to_schedule(doc, method=None):
         )
 
 
+@instrumented
 def link_purchase_invoice_to_schedule(doc, method=None):
     """
     Link Purchase Invoice back to Payment Schedule after it's created.
     Purchase Invoice is always linked to the LAST row of Payment Schedule.
     This runs after_insert, so the document already has a name.
     """
+    # Already linked by create_from_schedule_row
+    if doc.flags.payment_tracking_schedule_linked:
+        return
+
     # Only process if it has items linked to a Purchase Order
     if not doc.items:
         return
@@ -131,30 +120,11 @@ def link_purchase_invoice_to_schedule(doc, method=None):
         return
 
     try:
-        # Get the Purchase Order
-        po = frappe.get_doc("Purchase Order", purchase_order_name)
-
-        # Check if Purchase Order has payment schedule
-        if not po.payment_schedule or len(po.payment_schedule) == 0:
+        # Lock the LAST row of payment schedule and link Purchase Invoice to it,
+        # unless it already has an invoice linked (or there is no schedule)
+        if not link_schedule_row("Purchase Order", purchase_order_name, "Purchase Invoice", doc.name, only_if_empty=True):
             return
 
-        # Get the LAST row of payment schedule
-        last_row = po.payment_schedule[-1]
-
-        # Check if last row already has an invoice linked
-        if last_row.custom_invoice_name:
-            # Already linked, skip
-            return
-
-        # Link Purchase Invoice to the last row
-        last_row.custom_invoice_doctype = "Purchase Invoice"
-        last_row.custom_invoice_name = doc.name
-
-        # Save the Purchase Order (ignore permissions to allow system update)
-        po.flags.ignore_validate_update_after_submit = True
-        po.flags.ignore_permissions = True
-        po.save()
-
         frappe.msgprint(
             _("Purchase Invoice {0} linked to Payment Schedule last row").format(
                 frappe.bold(doc.name)
@@ -168,15 +138,18 @@ def link_purchase_invoice_to_schedule(doc, method=None):
         )
 
 
+@instrumented
 def unlink_purchase_invoice_from_schedule(doc, method=None):
     """
-    Remove Purchase Invoice link from Payment Schedule when PI is cancelled.
-    This runs before_cancel of Purchase Invoice.
+    Remove Purchase Invoice link from Payment Schedule when PI is cancelled or deleted.
+    This runs before_cancel and on_trash of Purchase Invoice, so a deleted draft
+    does not keep the row marked as invoiced.
     """
     _do_unlink_purchase_invoice(doc.name, doc.items)
 
 
 @frappe.whitelist()
+@instrumented
 def unlink_purchase_invoice_before_cancel(invoice_name):
     """
     Whitelisted API to unlink Purchase Invoice from PO Payment Schedule.
@@ -202,32 +175,8 @@ def _do_unlink_purchase_invoice(invoice_name, items):
         return
 
     try:
-        # Find Payment Schedule rows that link to this Purchase Invoice
-        schedule_rows = frappe.get_all(
-            "Payment Schedule",
-            filters={
-                "parent": purchase_order_name,
-                "parenttype": "Purchase Order",
-                "custom_invoice_doctype": "Purchase Invoice",
-                "custom_invoice_name": invoice_name
-            },
-            fields=["name", "idx"]
-        )
-
-        if not schedule_rows:
-            return
-
-        # Clear the links
-        for row in schedule_rows:
-            frappe.db.set_value(
-                "Payment Schedule",
-                row.name,
-                {
-                    "custom_invoice_doctype": "",
-                    "custom_invoice_name": ""
-                },
-                update_modified=False
-            )
+        # Clear the links of all Payment Schedule rows pointing to this Purchase Invoice
+        unlink_schedule_rows("Purchase Order", [purchase_order_name], "Purchase Invoice", [invoice_name])
 
     except Exception as e:
         frappe.log_error(
@@ -236,43 +185,22 @@ def _do_unlink_purchase_invoice(invoice_name, items):
         )
 
 
+@instrumented
 def unlink_payment_request_from_schedule(doc, method=None):
     """
-    Remove Payment Request link from Payment Schedule when PR is cancelled.
-    This runs on_cancel of Payment Request.
+    Remove Payment Request link from Payment Schedule when PR is cancelled or deleted.
+    This runs on_cancel and on_trash of Payment Request, so a deleted draft
+    does not keep the row marked as requested.
     """
     # Only process if it's linked to a Purchase Order
     if doc.reference_doctype != "Purchase Order" or not doc.reference_name:
         return
 
     try:
-        # Find Payment Schedule rows that link to this Payment Request
-        schedule_rows = frappe.get_all(
-            "Payment Schedule",
-            filters={
-                "parent": doc.reference_name,
-                "parenttype": "Purchase Order",
-                "custom_invoice_doctype": "Payment Request",
-                "custom_invoice_name": doc.name
-            },
-            fields=["name", "idx"]
-        )
-
-        if not schedule_rows:
+        # Clear the links of all Payment Schedule rows pointing to this Payment Request
+        if not unlink_schedule_rows("Purchase Order", [doc.reference_name], "Payment Request", [doc.name]):
             return
 
-        # Clear the links
-        for row in schedule_rows:
-            frappe.db.set_value(
-                "Payment Schedule",
-                row.name,
-                {
-                    "custom_invoice_doctype": "",
-                    "custom_invoice_name": ""
-                },
-                update_modified=False
-            )
-
         frappe.msgprint(
             _("Payment Request {0} unlinked from Payment Schedule").format(
                 frappe.bold(doc.name)
@@ -1,71 +1,61 @@
 import frappe
 from frappe import _
 
+from payment_tracking.sc_payment import payment_request_availability, schedule_documents
+from payment_tracking.sc_payment.instrumentation import instrumented
+from payment_tracking.sc_payment.schedule_links import link_schedule_row, unlink_schedule_rows
+
 
 @frappe.whitelist()
+@instrumented
 def can_create_payment_request(sales_order, payment_amount):
     """
     Validate if Payment Request can be created (ERPNext standard logic)
+    Reads only the Sales Order amount columns instead of loading the whole document.
     Returns: {can_create: bool, error_message: str}
     """
-    so = frappe.get_doc("Sales Order", sales_order)
-    payment_amount = float(payment_amount)
-
-    # Calculate available amount (same as ERPNext)
-    grand_total = so.rounded_total or so.grand_total
-    advance_paid = so.advance_paid or 0
-    available_amount = grand_total - advance_paid
-
-    # If already fully paid
-    if available_amount <= 0:
-        return {
-            "can_create": False,
-            "error_message": _("Payment Entry is already created")
-        }
-
-    # Get existing Payment Request amount (all submitted PRs)
-    existing_pr_amount = get_existing_payment_request_amount(so)
-
-    # Calculate remaining amount after existing PRs
-    remaining_amount = available_amount - existing_pr_amount
-
-    if remaining_amount <= 0:
-        return {
-            "can_create": False,
-            "error_message": _("Payment Request is already created")
-        }
-
-    # Check if new PR amount would exceed available
-    if payment_amount > remaining_amount:
-        return {
-            "can_create": False,
-            "error_message": _("Payment Request amount ({0}) exceeds available amount ({1})").format(
-                frappe.format_value(payment_amount, {"fieldtype": "Currency"}),
-                frappe.format_value(remaining_amount, {"fieldtype": "Currency"})
-            )
-        }
+    frappe.has_permission("Sales Order", "read", throw=True)
 
-    return {"can_create": True}
+    return payment_request_availability.can_create_payment_request("Sales Order", sales_order, payment_amount)
 
 
-def get_existing_payment_request_amount(sales_order_doc):
-    """Get total amount of all submitted Payment Requests against Sales Order"""
-    from frappe.query_builder import DocType
-    from frappe.query_builder.functions import Sum
+@frappe.whitelist()
+@instrumented
+def get_payment_schedule_availability(sales_orders):
+    """
+    Availability of every Payment Schedule row of one or more Sales Orders in one call.
+    sales_orders: name or list / JSON list of names.
+    Returns: {sales_order: [{name, idx, action, can_create, error_message, ...}]}
+    """
+    frappe.has_permission("Sales Order", "read", throw=True)
+
+    if isinstance(sales_orders, str) and not sales_orders.startswith("["):
+        sales_orders = [sales_orders]
+
+    return payment_request_availability.get_schedule_availability("Sales Order", frappe.parse_json(sales_orders))
 
-    PR = DocType("Payment Request")
 
-    result = (
-        frappe.qb.from_(PR)
-        .select(Sum(PR.grand_total))
-        .where(PR.reference_doctype == "Sales Order")
-        .where(PR.reference_name == sales_order_doc.name)
-        .where(PR.docstatus == 1)  # Only submitted
-    ).run()
+@frappe.whitelist(methods=["POST"])
+@instrumented
+def create_from_schedule_row(sales_order, row_idx):
+    """
+    Validate, create and link a draft Payment Request (advance rows) or
+    Sales Invoice (last row) for one Payment Schedule row in one transaction.
+    Returns: {doctype, name} of the new document
+    """
+    frappe.has_permission("Sales Order", "read", doc=sales_order, throw=True)
+
+    return schedule_documents.create_from_schedule_row("Sales Order", sales_order, row_idx)
 
-    return result[0][0] or 0
 
+def get_existing_payment_request_amount(sales_order_doc):
+    """Get total amount of all submitted Payment Requests against Sales Order"""
+    return payment_request_availability.get_payment_requested_amounts(
+        "Sales Order", [sales_order_doc.name]
+    ).get(sales_order_doc.name, 0)
 
+
+@instrumented
 def link_payment_request_to_schedule(doc, method=None):
     """
     Link Payment Request back to Payment Schedule after it's created.
@@ -79,22 +69,16 @@ def link_payment_request_to_schedule(doc, method=None):
     if not hasattr(doc, 'payment_term_pos') or not doc.payment_term_pos:
         return
 
+    # Already linked by create_from_schedule_row
+    if doc.flags.payment_tracking_schedule_linked:
+        return
+
     try:
-        # Get the Sales Order
-        so = frappe.get_doc("Sales Order", doc.reference_name)
-
-        # Find the payment schedule row by payment_term_pos (idx)
-        for schedule_row in so.payment_schedule:
-            if schedule_row.idx == doc.payment_term_pos:
-                # Update the custom fields
-                schedule_row.custom_invoice_doctype = "Payment Request"
-                schedule_row.custom_invoice_name = doc.name
-                break
-
-        # Save the Sales Order (ignore permissions to allow system update)
-        so.flags.ignore_validate_update_after_submit = True
-        so.flags.ignore_permissions = True
-        so.save()
+        # Lock and update only the payment schedule row at payment_term_pos (idx)
+        if not link_schedule_row(
+            "Sales Order", doc.reference_name, "Payment Request", doc.name, idx=doc.payment_term_pos
+        ):
+            return
 
         frappe.msgprint(
             _("Payment Request {0} linked to Payment Schedule row {1}").format(
@@ -110,12 +94,17 @@ def link_payment_request_to_schedule(doc, method=None):
         )
 
 
+@instrumented
 def link_sales_invoice_to_schedule(doc, method=None):
     """
     Link Sales Invoice back to Payment Schedule after it's created.
     Sales Invoice is always linked to the LAST row of Payment Schedule.
     This runs after_insert, so the document already has a name.
     """
+    # Already linked by create_from_schedule_row
+    if doc.flags.payment_tracking_schedule_linked:
+        return
+
     # Only process if it has items linked to a Sales Order
     if not doc.items:
         return
@@ -131,30 +120,11 @@ def link_sales_invoice_to_schedule(doc, method=None):
         return
 
     try:
-        # Get the Sales Order
-        so = frappe.get_doc("Sales Order", sales_order_name)
-
-        # Check if Sales Order has payment schedule
-        if not so.payment_schedule or len(so.payment_schedule) == 0:
+        # Lock the LAST row of payment schedule and link Sales Invoice to it,
+        # unless it already has an invoice linked (or there is no schedule)
+        if not link_schedule_row("Sales Order", sales_order_name, "Sales Invoice", doc.name, only_if_empty=True):
             return
 
-        # Get the LAST row of payment schedule
-        last_row = so.payment_schedule[-1]
-
-        # Check if last row already has an invoice linked
-        if last_row.custom_invoice_name:
-            # Already linked, skip
-            return
-
-        # Link Sales Invoice to the last row
-        last_row.custom_invoice_doctype = "Sales Invoice"
-        last_row.custom_invoice_name = doc.name
-
-        # Save the Sales Order (ignore permissions to allow system update)
-        so.flags.ignore_validate_update_after_submit = True
-        so.flags.ignore_permissions = True
-        so.save()
-
         frappe.msgprint(
             _("Sales Invoice {0} linked to Payment Schedule last row").format(
                 frappe.bold(doc.name)
@@ -168,15 +138,18 @@ def link_sales_invoice_to_schedule(doc, method=None):
         )
 
 
+@instrumented
 def unlink_sales_invoice_from_schedule(doc, method=None):
     """
-    Remove Sales Invoice link from Payment Schedule when SI is cancelled.
-    This runs before_cancel of Sales Invoice.
+    Remove Sales Invoice link from Payment Schedule when SI is cancelled or deleted.
+    This runs before_cancel and on_trash of Sales Invoice, so a deleted draft
+    does not keep the row marked as invoiced.
     """
     _do_unlink_sales_invoice(doc.name, doc.items)
 
 
 @frappe.whitelist()
+@instrumented
 def unlink_sales_invoice_before_cancel(invoice_name):
     """
     Whitelisted API to unlink Sales Invoice from SO Payment Schedule.
@@ -202,32 +175,8 @@ def _do_unlink_sales_invoice(invoice_name, items):
         return
 
     try:
-        # Find Payment Schedule rows that link to this Sales Invoice
-        schedule_rows = frappe.get_all(
-            "Payment Schedule",
-            filters={
-                "parent": sales_order_name,
-                "parenttype": "Sales Order",
-                "custom_invoice_doctype": "Sales Invoice",
-                "custom_invoice_name": invoice_name
-            },
-            fields=["name", "idx"]
-        )
-
-        if not schedule_rows:
-            return
-
-        # Clear the links
-        for row in schedule_rows:
-            frappe.db.set_value(
-                "Payment Schedule",
-                row.name,
-                {
-                    "custom_invoice_doctype": "",
-                    "custom_invoice_name": ""
-                },
-                update_modified=False
-            )
+        # Clear the links of all Payment Schedule rows pointing to this Sales Invoice
+        unlink_schedule_rows("Sales Order", [sales_order_name], "Sales Invoice", [invoice_name])
 
     except Exception as e:
         frappe.log_error(
@@ -236,43 +185,22 @@ def _do_unlink_sales_invoice(invoice_name, items):
         )
 
 
+@instrumented
 def unlink_payment_request_from_schedule(doc, method=None):
     """
-    Remove Payment Request link from Payment Schedule when PR is cancelled.
-    This runs on_cancel of Payment Request.
+    Remove Payment Request link from Payment Schedule when PR is cancelled or deleted.
+    This runs on_cancel and on_trash of Payment Request, so a deleted draft
+    does not keep the row marked as requested.
     """
     # Only process if it's linked to a Sales Order
     if doc.reference_doctype != "Sales Order" or not doc.reference_name:
         return
 
     try:
-        # Find Payment Schedule rows that link to this Payment Request
-        schedule_rows = frappe.get_all(
-            "Payment Schedule",
-            filters={
-                "parent": doc.reference_name,
-                "parenttype": "Sales Order",
-                "custom_invoice_doctype": "Payment Request",
-                "custom_invoice_name": doc.name
-            },
-            fields=["name", "idx"]
-        )
-
-        if not schedule_rows:
+        # Clear the links of all Payment Schedule rows pointing to this Payment Request
+        if not unlink_schedule_rows("Sales Order", [doc.reference_name], "Payment Request", [doc.name]):
             return
 
-        # Clear the links
-        for row in schedule_rows:
-            frappe.db.set_value(
-                "Payment Schedule",
-                row.name,
-                {
-                    "custom_invoice_doctype": "",
-                    "custom_invoice_name": ""
-                },
-                update_modified=False
-            )
-
         frappe.msgprint(
             _("Payment Request {0} unlinked from Payment Schedule").format(
                 frappe.bold(doc.name)
@@ -0,0 +1,92 @@
+import frappe
+from frappe import _
+
+from payment_tracking.sc_payment.bulk_schedule_documents import BULK_BATCH_SIZE
+from payment_tracking.sc_payment.instrumentation import instrumented
+from payment_tracking.sc_payment.schedule_documents import SCHEDULE_DOCUMENT_MAP
+from payment_tracking.sc_payment.schedule_links import bulk_unlink_from_schedule
+
+
+@frappe.whitelist(methods=["POST"])
+@instrumented
+def bulk_unlink_schedule_links(doctype, names):
+    """
+    Clear the Payment Schedule links of many Payment Requests or Invoices in one pass,
+    e.g. before a mass cancellation.
+
+    doctype: "Payment Request", "Purchase Invoice" or "Sales Invoice"
+    names: list / JSON list of document names
+    Returns: {order_doctype: {order_name: rows cleared}}
+    """
+    if doctype not in ("Payment Request", "Purchase Invoice", "Sales Invoice"):
+        frappe.throw(_("Schedule links are not tracked for {0}").format(doctype))
+
+    frappe.has_permission(doctype, "cancel", throw=True)
+
+    return bulk_unlink_from_schedule(doctype, frappe.parse_json(names) or [])
+
+
+@frappe.whitelist(methods=["POST"])
+@instrumented
+def enqueue_bulk_payment_requests(order_doctype, due_date=None, submit=0, batch_size=BULK_BATCH_SIZE):
+    """
+    Queue a background job creating Payment Requests for every advance Payment Schedule
+    row due on or before due_date (default today) that has no document linked yet.
+
+    order_doctype: "Purchase Order" or "Sales Order"
+    submit: submit the Payment Requests (no party emails) instead of leaving drafts.
+        Draft Payment Requests are not counted in custom_payment_requested_amount
+        (only submitted ones are), so with submit=0 every due row of an Order gets
+        a draft even if together they exceed the Order's available amount; the
+        amount is validated again when each draft is submitted.
+    Progress: payment_tracking_bulk_progress / payment_tracking_bulk_done realtime events
+    """
+    validate_order_doctype(order_doctype)
+    frappe.has_permission("Payment Request", "submit" if frappe.utils.cint(submit) else "create", throw=True)
+
+    frappe.enqueue(
+        "payment_tracking.sc_payment.bulk_schedule_documents.generate_payment_requests",
+        queue="long",
+        timeout=4 * 60 * 60,
+        job_id=f"payment_tracking::bulk_payment_requests::{order_doctype}",
+        deduplicate=True,
+        order_doctype=order_doctype,
+        due_date=due_date,
+        submit=frappe.utils.cint(submit),
+        batch_size=frappe.utils.cint(batch_size) or BULK_BATCH_SIZE,
+        notify_user=frappe.session.user,
+    )
+    return _("Payment Request generation queued in background")
+
+
+@frappe.whitelist(methods=["POST"])
+@instrumented
+def enqueue_bulk_final_invoices(order_doctype, due_date=None, batch_size=BULK_BATCH_SIZE):
+    """
+    Queue a background job creating draft Purchase/Sales Invoices for every submitted Order
+    whose last Payment Schedule row is due on or before due_date (default today) and unlinked.
+
+    order_doctype: "Purchase Order" or "Sales Order"
+    Progress: payment_tracking_bulk_progress / payment_tracking_bulk_done realtime events
+    """
+    validate_order_doctype(order_doctype)
+    invoice_doctype = SCHEDULE_DOCUMENT_MAP[order_doctype].invoice_doctype
+    frappe.has_permission(invoice_doctype, "create", throw=True)
+
+    frappe.enqueue(
+        "payment_tracking.sc_payment.bulk_schedule_documents.generate_final_invoices",
+        queue="long",
+        timeout=4 * 60 * 60,
+        job_id=f"payment_tracking::bulk_final_invoices::{order_doctype}",
+        deduplicate=True,
+        order_doctype=order_doctype,
+        due_date=due_date,
+        batch_size=frappe.utils.cint(batch_size) or BULK_BATCH_SIZE,
+        notify_user=frappe.session.user,
+    )
+    return _("{0} generation queued in background").format(_(invoice_doctype))
+
+
+def validate_order_doctype(order_doctype):
+    if order_doctype not in SCHEDULE_DOCUMENT_MAP:
+        frappe.throw(_("Documents from schedule are not supported for {0}").format(order_doctype))
@@ -0,0 +1,79 @@
+"""
+Bench commands for payment_tracking
+
+Usage:
+    bench --site <site_name> rebuild-payment-totals [--doctype "Sales Order"]
+    bench --site <site_name> backfill-order-invoice-links
+    bench --site <site_name> rebuild-payment-requested-amounts [--doctype "Sales Order"]
+"""
+
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("rebuild-payment-totals")
+@click.option("--doctype", multiple=True, help="Only rebuild this doctype (can be repeated)")
+@pass_context
+def rebuild_payment_totals(context, doctype=None):
+    """Rebuild custom_total_payment with one set-based UPDATE per doctype"""
+    import frappe
+
+    from payment_tracking.sc_payment.recalculation import rebuild_totals_sql
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+
+    try:
+        summary = rebuild_totals_sql(list(doctype) or None)
+    finally:
+        frappe.destroy()
+
+    for name, counts in summary.items():
+        click.echo(f"{name}: {counts['updated']} of {counts['documents']} documents updated")
+
+
+@click.command("backfill-order-invoice-links")
+@pass_context
+def backfill_order_invoice_link_index(context):
+    """Rebuild the Order Invoice Link index from invoice items"""
+    import frappe
+
+    from payment_tracking.sc_payment.order_invoice_links import backfill_order_invoice_links
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+
+    try:
+        summary = backfill_order_invoice_links()
+    finally:
+        frappe.destroy()
+
+    for invoice_doctype, rows in summary.items():
+        click.echo(f"{invoice_doctype}: {rows} Order links indexed")
+
+
+@click.command("rebuild-payment-requested-amounts")
+@click.option("--doctype", multiple=True, help="Only rebuild this doctype (can be repeated)")
+@pass_context
+def rebuild_payment_requested_amount_totals(context, doctype=None):
+    """Rebuild custom_payment_requested_amount on Orders from submitted Payment Requests"""
+    import frappe
+
+    from payment_tracking.sc_payment.payment_request_availability import rebuild_payment_requested_amounts
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+
+    try:
+        summary = rebuild_payment_requested_amounts(list(doctype) or None)
+    finally:
+        frappe.destroy()
+
+    for name, updated in summary.items():
+        click.echo(f"{name}: {updated} documents updated")
+
+
+commands = [rebuild_payment_totals, backfill_order_invoice_link_index, rebuild_payment_requested_amount_totals]
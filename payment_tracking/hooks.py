@@ -153,10 +153,21 @@ override_doctype_class = {
 
 doc_events = {
     "Payment Entry": {
-        "before_submit": "payment_tracking.sc_payment.doctype_events.payment_entry.populate_payment_schedule_idx",
+        "before_submit": [
+            "payment_tracking.sc_payment.order_locks.lock_payment_entry_orders",
+            "payment_tracking.sc_payment.doctype_events.payment_entry.populate_payment_schedule_idx"
+        ],
+        "before_cancel": "payment_tracking.sc_payment.order_locks.lock_payment_entry_orders",
+        "on_update": "payment_tracking.sc_payment.document_links.update_document_links_data",
         "on_submit": "payment_tracking.sc_payment.doctype_events.payment_entry.update_total_payments",
-        "on_update_after_submit": "payment_tracking.sc_payment.doctype_events.payment_entry.update_total_payments",
-        "on_cancel": "payment_tracking.sc_payment.doctype_events.payment_entry.update_total_payments",
+        "on_update_after_submit": [
+            "payment_tracking.sc_payment.doctype_events.payment_entry.update_total_payments",
+            "payment_tracking.sc_payment.document_links.update_document_links_data"
+        ],
+        "on_cancel": [
+            "payment_tracking.sc_payment.doctype_events.payment_entry.update_total_payments",
+            "payment_tracking.sc_payment.document_links.update_document_links_data"
+        ],
         "on_trash": "payment_tracking.sc_payment.doctype_events.payment_entry.update_total_payments"
     },
     "Payment Request": {
@@ -164,24 +175,80 @@ doc_events = {
             "payment_tracking.api.sales_order_utils.link_payment_request_to_schedule",
             "payment_tracking.api.purchase_order_utils.link_payment_request_to_schedule"
         ],
+        "on_submit": [
+            "payment_tracking.sc_payment.payment_request_availability.update_payment_requested_amount",
+            "payment_tracking.sc_payment.document_links.refresh_payment_request_reference_links"
+        ],
         "on_cancel": [
+            "payment_tracking.api.sales_order_utils.unlink_payment_request_from_schedule",
+            "payment_tracking.api.purchase_order_utils.unlink_payment_request_from_schedule",
+            "payment_tracking.sc_payment.payment_request_availability.update_payment_requested_amount",
+            "payment_tracking.sc_payment.document_links.refresh_payment_request_reference_links"
+        ],
+        "on_trash": [
             "payment_tracking.api.sales_order_utils.unlink_payment_request_from_schedule",
             "payment_tracking.api.purchase_order_utils.unlink_payment_request_from_schedule"
         ]
     },
     "Sales Invoice": {
         "after_insert": "payment_tracking.api.sales_order_utils.link_sales_invoice_to_schedule",
-        "before_cancel": "payment_tracking.api.sales_order_utils.unlink_sales_invoice_from_schedule"
+        "before_cancel": [
+            "payment_tracking.api.sales_order_utils.unlink_sales_invoice_from_schedule",
+            "payment_tracking.sc_payment.document_links.remember_invoice_payment_entries"
+        ],
+        "on_update": "payment_tracking.sc_payment.order_invoice_links.sync_invoice_links",
+        "on_submit": "payment_tracking.sc_payment.order_invoice_links.sync_invoice_links",
+        "on_cancel": [
+            "payment_tracking.sc_payment.order_invoice_links.sync_invoice_links",
+            "payment_tracking.sc_payment.document_links.refresh_invoice_payment_entries"
+        ],
+        "on_trash": [
+            "payment_tracking.api.sales_order_utils.unlink_sales_invoice_from_schedule",
+            "payment_tracking.sc_payment.order_invoice_links.remove_invoice_links"
+        ]
     },
     "Purchase Invoice": {
         "after_insert": "payment_tracking.api.purchase_order_utils.link_purchase_invoice_to_schedule",
         "before_save": "payment_tracking.sc_payment.doctype_events.purchase_invoice.before_save",
         "before_submit": "payment_tracking.sc_payment.doctype_events.purchase_invoice.before_submit",
-        "before_cancel": "payment_tracking.api.purchase_order_utils.unlink_purchase_invoice_from_schedule"
+        "before_cancel": [
+            "payment_tracking.api.purchase_order_utils.unlink_purchase_invoice_from_schedule",
+            "payment_tracking.sc_payment.document_links.remember_invoice_payment_entries"
+        ],
+        "on_update": [
+            "payment_tracking.sc_payment.order_invoice_links.sync_invoice_links",
+            "payment_tracking.sc_payment.document_links.update_document_links_data"
+        ],
+        "on_submit": "payment_tracking.sc_payment.order_invoice_links.sync_invoice_links",
+        "on_cancel": [
+            "payment_tracking.sc_payment.order_invoice_links.sync_invoice_links",
+            "payment_tracking.sc_payment.document_links.refresh_invoice_payment_entries",
+            "payment_tracking.sc_payment.document_links.update_document_links_data"
+        ],
+        "on_trash": [
+            "payment_tracking.api.purchase_order_utils.unlink_purchase_invoice_from_schedule",
+            "payment_tracking.sc_payment.order_invoice_links.remove_invoice_links"
+        ]
     },
     "Purchase Order": {
         "before_validate": "payment_tracking.sc_payment.doctype_events.purchase_order.before_validate",
-        "validate": "payment_tracking.sc_payment.doctype_events.purchase_order.validate"
+        "validate": "payment_tracking.sc_payment.doctype_events.purchase_order.validate",
+        "on_update": "payment_tracking.sc_payment.schedule_cache.invalidate_document_schedule",
+        "on_update_after_submit": "payment_tracking.sc_payment.schedule_cache.invalidate_document_schedule"
+    },
+    "Sales Order": {
+        "on_update": "payment_tracking.sc_payment.schedule_cache.invalidate_document_schedule",
+        "on_update_after_submit": "payment_tracking.sc_payment.schedule_cache.invalidate_document_schedule"
+    },
+    "Customer": {
+        "on_update": "payment_tracking.sc_payment.party_names.invalidate_party_name",
+        "after_rename": "payment_tracking.sc_payment.party_names.invalidate_party_name",
+        "on_trash": "payment_tracking.sc_payment.party_names.invalidate_party_name"
+    },
+    "Supplier": {
+        "on_update": "payment_tracking.sc_payment.party_names.invalidate_party_name",
+        "after_rename": "payment_tracking.sc_payment.party_names.invalidate_party_name",
+        "on_trash": "payment_tracking.sc_payment.party_names.invalidate_party_name"
     }
 }
 
@@ -202,7 +269,11 @@ fixtures = [
                     "Payment Schedule-custom_invoice_name",
                     "Purchase Order-custom_manual_payment_schedule",
                     "Payment Request-custom_due_date",
-                    "Payment Entry Reference-custom_payment_schedule_idx"
+                    "Payment Entry Reference-custom_payment_schedule_idx",
+                    "Payment Entry-custom_document_links_data",
+                    "Purchase Invoice-custom_document_links_data",
+                    "Purchase Order-custom_payment_requested_amount",
+                    "Sales Order-custom_payment_requested_amount"
                 ]
             ]
         ]
@@ -256,16 +327,25 @@ fixtures = [
 # -----------------------------------------------------------
 
 # ignore_links_on_delete = ["Communication", "ToDo"]
+ignore_links_on_delete = ["Order Invoice Link"]
 
 # Request Events
 # ----------------
 # before_request = ["payment_tracking.utils.before_request"]
 # after_request = ["payment_tracking.utils.after_request"]
+after_request = [
+    "payment_tracking.sc_payment.metrics.flush_metrics",
+    "payment_tracking.sc_payment.instrumentation.flush_instrumentation"
+]
 
 # Job Events
 # ----------
 # before_job = ["payment_tracking.utils.before_job"]
 # after_job = ["payment_tracking.utils.after_job"]
+after_job = [
+    "payment_tracking.sc_payment.metrics.flush_metrics",
+    "payment_tracking.sc_payment.instrumentation.flush_instrumentation"
+]
 
 # User Data Protection
 # --------------------
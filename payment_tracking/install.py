@@ -1,12 +1,16 @@
 import frappe
 from .sc_payment.custom_fields import create_payment_tracking_fields
+from .sc_payment.order_invoice_links import backfill_order_invoice_links
 
 def after_install():
     """Run after app installation"""
     try:
         # Create custom fields
         create_payment_tracking_fields()
-        
+
+        # Index Order <-> Invoice links of existing invoices
+        backfill_order_invoice_links()
+
         frappe.msgprint("Payment Tracking app installed successfully!")
         
     except Exception as e:
@@ -0,0 +1,30 @@
+"""
+Patch: Backfill Document Links Data
+
+Creates the `custom_document_links_data` fields and stores the link chain
+(party, Orders, Invoices, Payment Requests) on existing Payment Entries and
+Purchase Invoices, so their forms render without extra requests. Afterwards
+the data is maintained by document hooks.
+
+Execution: Runs automatically during `bench migrate`
+"""
+
+import frappe
+
+from payment_tracking.sc_payment.custom_fields import create_payment_tracking_fields
+from payment_tracking.sc_payment.document_links import backfill_document_links_data
+
+
+def execute():
+    """
+    Store document links data on documents that have none yet
+    """
+    frappe.logger().info("Backfilling document links data...")
+
+    create_payment_tracking_fields()
+    summary = backfill_document_links_data()
+
+    for doctype, count in summary.items():
+        frappe.logger().info(f"Stored document links data on {count} {doctype} documents")
+
+    print("✅ Payment Tracking: Document links data backfilled")
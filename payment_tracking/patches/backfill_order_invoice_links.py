@@ -0,0 +1,27 @@
+"""
+Patch: Backfill Order Invoice Link index
+
+Fills `tabOrder Invoice Link` from the Sales/Purchase Invoice Item tables so
+payment hooks and document link lookups can use it instead of scanning items.
+Afterwards the index is maintained by invoice hooks.
+
+Execution: Runs automatically during `bench migrate`
+"""
+
+import frappe
+
+from payment_tracking.sc_payment.order_invoice_links import backfill_order_invoice_links
+
+
+def execute():
+    """
+    Rebuild the Order Invoice Link index from invoice items
+    """
+    frappe.logger().info("Backfilling Order Invoice Link index...")
+
+    summary = backfill_order_invoice_links()
+
+    for invoice_doctype, rows in summary.items():
+        frappe.logger().info(f"Indexed {rows} Order links for {invoice_doctype}")
+
+    print("✅ Payment Tracking: Order Invoice Link index backfilled")
@@ -0,0 +1,29 @@
+"""
+Patch: Rebuild Payment Requested Amounts
+
+Creates `custom_payment_requested_amount` on Purchase/Sales Orders and fills
+it from submitted Payment Requests. Afterwards the running total is
+maintained by Payment Request submit/cancel hooks.
+
+Execution: Runs automatically during `bench migrate`
+"""
+
+import frappe
+
+from payment_tracking.sc_payment.custom_fields import create_payment_tracking_fields
+from payment_tracking.sc_payment.payment_request_availability import rebuild_payment_requested_amounts
+
+
+def execute():
+    """
+    Fill the Order-level Payment Request totals
+    """
+    frappe.logger().info("Rebuilding Payment Request totals on Orders...")
+
+    create_payment_tracking_fields()
+    summary = rebuild_payment_requested_amounts()
+
+    for doctype, updated in summary.items():
+        frappe.logger().info(f"Updated Payment Request totals on {updated} {doctype} documents")
+
+    print("✅ Payment Tracking: Payment Request totals rebuilt")
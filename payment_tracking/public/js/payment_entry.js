@@ -70,67 +70,75 @@ function update_document_links_details(frm) {
         return;
     }
 
-    // First get the party name
+    // Render from the links stored on save/submit when the form has no unsaved changes
+    const stored_links = !frm.is_dirty() && parse_document_links_data(frm.doc.custom_document_links_data);
+    if (stored_links) {
+        build_complete_payment_entry_html(
+            frm.doc.party,
+            frm.doc.party_name || frm.doc.party,
+            stored_links.orders || [],
+            stored_links.invoices || [],
+            frm
+        );
+        return;
+    }
+
+    // Party name, Orders (direct and through invoices) and Invoices in one call
     frappe.call({
-        method: "payment_tracking.api.payment_entry_utils.get_party_name",
+        method: "payment_tracking.api.payment_entry_utils.get_document_links",
         args: {
+            doctype: frm.doc.doctype,
+            name: frm.doc.name,
             party_type: frm.doc.party_type,
-            party_id: frm.doc.party
+            party: frm.doc.party
         },
         callback: function(r) {
-            const party_name = r.message || frm.doc.party;
-
-            // Then get connected orders and build complete HTML
-            get_connected_orders_and_build_html(frm, frm.doc.party, party_name);
+            const links = r.message || {};
+            // Direct Orders and Invoices from the form (reflects unsaved changes),
+            // Orders reached through invoices from the server
+            const indirect_orders = (links.orders || []).filter(order => !order.direct);
+            build_complete_payment_entry_html(
+                frm.doc.party,
+                links.party_name || frm.doc.party,
+                unique_references([...get_form_references(frm, ['Sales Order', 'Purchase Order']), ...indirect_orders]),
+                unique_references(get_form_references(frm, ['Sales Invoice', 'Purchase Invoice'])),
+                frm
+            );
         },
         error: function(err) {
-            console.warn('Error fetching party name:', err);
-            // Fallback to party ID
-            get_connected_orders_and_build_html(frm, frm.doc.party, frm.doc.party);
+            console.warn('Error fetching document links:', err);
+            // Fallback to party ID and references on the form
+            build_complete_payment_entry_html(
+                frm.doc.party,
+                frm.doc.party,
+                unique_references(get_form_references(frm, ['Sales Order', 'Purchase Order'])),
+                unique_references(get_form_references(frm, ['Sales Invoice', 'Purchase Invoice'])),
+                frm
+            );
         }
     });
 }
 
-function get_connected_orders_and_build_html(frm, party_id, party_name) {
-    // Get references from Payment Entry
-    const references = frm.doc.references || [];
+function get_form_references(frm, doctypes) {
+    return (frm.doc.references || []).filter(ref => ref.reference_name && doctypes.includes(ref.reference_doctype));
+}
 
-    // Separate references by type
-    const direct_orders = references.filter(ref =>
-        ref.reference_doctype === 'Sales Order' || ref.reference_doctype === 'Purchase Order'
-    );
-    const invoices = references.filter(ref =>
-        ref.reference_doctype === 'Sales Invoice' || ref.reference_doctype === 'Purchase Invoice'
+function unique_references(references) {
+    return references.filter((ref, index, self) =>
+        index === self.findIndex(r => r.reference_name === ref.reference_name)
     );
-
-    // Get connected orders using Python method
-    frappe.call({
-        method: "payment_tracking.api.payment_entry_utils.get_connected_orders_for_payment_entry",
-        args: {
-            payment_entry_name: frm.doc.name
-        },
-        callback: function(r) {
-            const connected_orders = r.message || [];
-
-            // Combine direct orders and connected orders
-            const all_orders = [...direct_orders, ...connected_orders];
-
-            // Remove duplicates
-            const unique_orders = all_orders.filter((order, index, self) =>
-                index === self.findIndex(o => o.reference_name === order.reference_name)
-            );
-
-            build_complete_payment_entry_html(party_id, party_name, unique_orders, invoices, frm);
-        },
-        error: function(err) {
-            console.warn('Error fetching connected orders:', err);
-            // Fallback to direct orders only
-            build_complete_payment_entry_html(party_id, party_name, direct_orders, invoices, frm);
-        }
-    });
 }
 
+function parse_document_links_data(data) {
+    if (!data) return null;
+    if (typeof data === 'object') return data;
 
+    try {
+        return JSON.parse(data);
+    } catch (e) {
+        return null;
+    }
+}
 
 function build_complete_payment_entry_html(party_id, party_name, orders, invoices, frm) {
     const party_text = party_id;
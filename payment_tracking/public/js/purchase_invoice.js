@@ -96,38 +96,55 @@ function update_supplier_po_details(frm) {
         return;
     }
 
-    // Get supplier name
-    frappe.db.get_value('Supplier', frm.doc.supplier, 'supplier_name')
-        .then(r => {
-            if (r.message) {
-                const supplier_name = r.message.supplier_name;
-                build_po_details_html(frm, frm.doc.supplier, supplier_name);
-            }
-        })
-        .catch(err => {
-            console.error('Error fetching supplier:', err);
-        });
-}
-
-function build_po_details_html(frm, supplier_id, supplier_name) {
-
-    // Get unique purchase orders from items
-    const purchase_orders = [...new Set(
+    // Purchase Orders from items (reflects unsaved changes)
+    const item_orders = [...new Set(
         frm.doc.items
             ?.filter(item => item.purchase_order)
             ?.map(item => item.purchase_order) || []
     )];
 
-    // Get Payment Requests first, then build complete HTML
-    get_payment_requests(frm.doc.name, function(payment_requests) {
-        if (purchase_orders.length === 0) {
-            // No PO, just show supplier info
-            build_complete_supplier_html(supplier_id, supplier_name, frm.doc.name, [], payment_requests, frm);
-            return;
-        }
+    // Render from the links stored on save/submit when the form has no unsaved changes
+    const stored_links = !frm.is_new() && !frm.is_dirty() && parse_document_links_data(frm.doc.custom_document_links_data);
+    if (stored_links) {
+        build_complete_supplier_html(
+            frm.doc.supplier,
+            frm.doc.supplier_name || frm.doc.supplier,
+            frm.doc.name,
+            [...new Set([...item_orders, ...(stored_links.orders || []).map(order => order.reference_name)])],
+            stored_links.payment_requests || [],
+            frm
+        );
+        return;
+    }
 
-        // Build complete HTML with PO and PR
-        build_complete_supplier_html(supplier_id, supplier_name, frm.doc.name, purchase_orders, payment_requests, frm);
+    // Supplier name, linked Purchase Orders and Payment Requests in one call
+    frappe.call({
+        method: "payment_tracking.api.payment_entry_utils.get_document_links",
+        args: {
+            doctype: frm.doc.doctype,
+            name: frm.doc.name,
+            party_type: 'Supplier',
+            party: frm.doc.supplier
+        },
+        callback: function(r) {
+            const links = r.message || {};
+            const purchase_orders = [...new Set([
+                ...item_orders,
+                ...(frm.is_new() ? [] : (links.orders || []).map(order => order.reference_name))
+            ])];
+
+            build_complete_supplier_html(
+                frm.doc.supplier,
+                links.party_name || frm.doc.supplier,
+                frm.doc.name,
+                purchase_orders,
+                frm.is_new() ? [] : (links.payment_requests || []),
+                frm
+            );
+        },
+        error: function(err) {
+            console.error('Error fetching document links:', err);
+        }
     });
 }
 
@@ -210,26 +227,13 @@ function fix_payment_schedule_outstanding(frm) {
     }
 }
 
-function get_payment_requests(invoice_name, callback) {
-    // Get Payment Requests that reference this Purchase Invoice
-    frappe.call({
-        method: "frappe.client.get_list",
-        args: {
-            doctype: "Payment Request",
-            filters: {
-                reference_doctype: "Purchase Invoice",
-                reference_name: invoice_name,
-                docstatus: ["=", 1] // Not cancelled
-            },
-            fields: ["name", "status", "grand_total"]
-        },
-        callback: function(r) {
-            if (r.message) {
-                callback(r.message);
-            } else {
-                callback([]);
-            }
-        }
-    });
-}
+function parse_document_links_data(data) {
+    if (!data) return null;
+    if (typeof data === 'object') return data;
 
+    try {
+        return JSON.parse(data);
+    } catch (e) {
+        return null;
+    }
+}
@@ -101,110 +101,30 @@ function add_create_buttons_to_payment_schedule(frm) {
                             });
                             return;
                         }
-                        // Create Purchase Invoice for the last payment schedule row
-                        create_purchase_invoice_from_schedule(frm, row_doc);
-                    } else {
-                        // Validate Payment Request can be created (ERPNext standard logic)
-                        validate_payment_request_creation(frm, row_doc, row_index);
                     }
+
+                    // Validate, create and link the Payment Request (Purchase Invoice for the last row) on the server
+                    create_document_from_schedule(frm, row_index);
                 });
             }
         }
     });
 }
 
-function validate_payment_request_creation(frm, schedule_row, row_index) {
-    // Call server to validate if Payment Request can be created (ERPNext standard logic)
+function create_document_from_schedule(frm, row_index) {
+    // One request: the server locks the schedule row, validates availability
+    // (ERPNext standard logic), creates a draft document and links the row to it
     frappe.call({
-        method: 'payment_tracking.api.purchase_order_utils.can_create_payment_request',
+        method: 'payment_tracking.api.purchase_order_utils.create_from_schedule_row',
         args: {
             purchase_order: frm.doc.name,
-            payment_amount: schedule_row.payment_amount
+            row_idx: row_index
         },
+        freeze: true,
         callback: function(r) {
-            if (r.message && r.message.can_create) {
-                // Validation passed - create Payment Request
-                create_payment_request_from_schedule(frm, schedule_row, row_index);
-            } else if (r.message && r.message.error_message) {
-                // Validation failed - show error
-                frappe.show_alert({
-                    message: r.message.error_message,
-                    indicator: 'red'
-                });
-            } else {
-                // Unexpected error
-                frappe.show_alert({
-                    message: __('Error validating Payment Request creation'),
-                    indicator: 'red'
-                });
-            }
-        },
-        error: function() {
-            frappe.show_alert({
-                message: __('Error validating Payment Request creation'),
-                indicator: 'red'
-            });
-        }
-    });
-}
-
-function create_payment_request_from_schedule(frm, schedule_row, row_index) {
-    // Create a new Payment Request based on the Payment Schedule row
-    frappe.model.with_doctype('Payment Request', function() {
-        let payment_request = frappe.model.get_new_doc('Payment Request');
-
-        // Set basic fields from Purchase Order
-        payment_request.payment_request_type = 'Outward';
-        payment_request.party_type = 'Supplier';
-        payment_request.party = frm.doc.supplier;
-        payment_request.currency = frm.doc.currency;
-        payment_request.company = frm.doc.company;
-
-        // Set reference to Purchase Order
-        payment_request.reference_doctype = 'Purchase Order';
-        payment_request.reference_name = frm.doc.name;
-
-        // Set amount from payment schedule row (grand_total = payment_amount)
-        payment_request.grand_total = schedule_row.payment_amount;
-
-        // Set custom field: payment_term_pos = index of current row
-        payment_request.payment_term_pos = row_index;
-
-        // Set payment term if available
-        if (schedule_row.payment_term) {
-            payment_request.payment_term = schedule_row.payment_term;
-        }
-
-        // Set due date from schedule
-        if (schedule_row.due_date) {
-            payment_request.due_date = schedule_row.due_date;
-            payment_request.custom_due_date = schedule_row.due_date;
-        }
-
-        // Note: Linking back to Payment Schedule is handled by server-side hook (after_insert)
-        // No need to set custom_invoice_doctype and custom_invoice_name here
-
-        // Open the new Payment Request form
-        frappe.set_route('Form', 'Payment Request', payment_request.name);
-    });
-}
-
-function create_purchase_invoice_from_schedule(frm, schedule_row) {
-    // Use Frappe's standard method to create Purchase Invoice from Purchase Order
-    frappe.model.open_mapped_doc({
-        method: "erpnext.buying.doctype.purchase_order.purchase_order.make_purchase_invoice",
-        frm: frm,
-        args: {
-            ignore_pricing_rule: 1
-        },
-        callback: function(new_doc) {
-            // Set due date from schedule if available
-            if (schedule_row.due_date) {
-                frappe.model.set_value(new_doc.doctype, new_doc.name, 'due_date', schedule_row.due_date);
+            if (r.message && r.message.name) {
+                frappe.set_route('Form', r.message.doctype, r.message.name);
             }
-
-            // Note: Linking back to Payment Schedule (last row) is handled by server-side hook (after_insert)
-            // Purchase Invoice is automatically linked to the last row of Payment Schedule
         }
     });
 }
@@ -0,0 +1,183 @@
+"""
+Bulk Payment Entry submission
+
+submit_payment_entries() submits many draft Payment Entries in chunks, one
+transaction per chunk (or a single one). While a chunk runs, the app's
+per-entry work is staged instead of executed:
+
+- Payment Schedule deltas from update_payment_schedule are summed per
+  schedule row and written with one UPDATE per chunk; the over-allocation
+  check sees the outstanding amounts already taken by earlier entries of
+  the chunk
+- documents whose custom_total_payment is affected are collected and
+  recomputed (or deferred) once per chunk, however many entries touch them
+
+Every entry runs under its own savepoint; a failing entry is rolled back
+together with its staged work and reported, the rest of the chunk goes on.
+A chunk that hits a deadlock is rolled back and retried as a whole.
+"""
+
+import time
+
+import frappe
+from frappe import _
+from frappe.utils import cint
+
+from payment_tracking.sc_payment.deadlocks import is_lock_conflict, retry_on_deadlock
+from payment_tracking.sc_payment.doctype_events.payment_entry import update_staged_total_payments
+from payment_tracking.sc_payment.order_locks import lock_orders
+from payment_tracking.sc_payment.overrides.payment_entry import apply_payment_schedule_deltas
+from payment_tracking.sc_payment.schedule_cache import invalidate_schedule
+
+BULK_SUBMIT_CHUNK_SIZE = 50
+
+# Failures kept in the summary (all of them are counted)
+MAX_REPORTED_FAILURES = 200
+
+
+class BulkSubmitContext:
+    """Work staged by the Payment Entry hooks during a bulk submit chunk"""
+
+    def __init__(self):
+        self.row_deltas = {}
+        self.total_documents = set()
+        self.entry_row_deltas = {}
+        self.entry_total_documents = set()
+
+    def stage_schedule_deltas(self, row_deltas):
+        for row_name, delta in row_deltas.items():
+            staged = self.entry_row_deltas.setdefault(row_name, [0.0] * len(delta))
+            for i, value in enumerate(delta):
+                staged[i] += value
+
+    def get_pending_delta(self, row_name, column):
+        """Staged delta of one column (index into PAYMENT_SCHEDULE_DELTA_COLUMNS) of a schedule row"""
+        return sum(
+            deltas[row_name][column]
+            for deltas in (self.row_deltas, self.entry_row_deltas)
+            if row_name in deltas
+        )
+
+    def stage_total_documents(self, documents):
+        self.entry_total_documents.update(documents)
+
+    def begin_entry(self):
+        self.entry_row_deltas = {}
+        self.entry_total_documents = set()
+
+    def accept_entry(self):
+        for row_name, delta in self.entry_row_deltas.items():
+            staged = self.row_deltas.setdefault(row_name, [0.0] * len(delta))
+            for i, value in enumerate(delta):
+                staged[i] += value
+
+        self.total_documents.update(self.entry_total_documents)
+        self.begin_entry()
+
+    def discard_entry(self):
+        self.begin_entry()
+
+
+def get_bulk_submit_context():
+    """Return the active BulkSubmitContext, or None outside a bulk submit"""
+    return frappe.flags.payment_tracking_bulk_submit
+
+
+def submit_payment_entries(names, chunk_size=BULK_SUBMIT_CHUNK_SIZE):
+    """
+    Submit draft Payment Entries, committing after every chunk_size entries
+    (0 submits everything in one transaction).
+
+    Returns {total, submitted, failed, failures: [{name, error}], chunks,
+    elapsed_seconds, entries_per_sec}.
+    """
+    names = list(dict.fromkeys(filter(None, names)))
+    chunk_size = cint(chunk_size) or len(names) or 1
+
+    summary = {"total": len(names), "submitted": 0, "failed": 0, "failures": [], "chunks": 0}
+    started = time.monotonic()
+
+    for start in range(0, len(names), chunk_size):
+        chunk = names[start:start + chunk_size]
+
+        try:
+            submitted, failures = retry_on_deadlock("bulk_submit", submit_chunk, chunk)
+        except Exception as e:
+            # The chunk's aggregated writes failed: none of its entries stay submitted
+            frappe.db.rollback()
+            invalidate_schedule()
+            submitted, failures = [], [(name, e) for name in chunk]
+
+        for name, error in failures:
+            add_failure(summary, name, error)
+
+        summary["submitted"] += len(submitted)
+        summary["chunks"] += 1
+
+    elapsed = time.monotonic() - started
+    summary["elapsed_seconds"] = round(elapsed, 1)
+    summary["entries_per_sec"] = round(summary["submitted"] / elapsed, 1) if elapsed else None
+
+    return summary
+
+
+def submit_chunk(chunk):
+    """
+    Submit one chunk of Payment Entries and commit it with its aggregated
+    writes. Returns (submitted names, [(name, error)]).
+
+    A deadlock aborts the whole transaction, so it is raised for the caller
+    to retry the chunk instead of being reported against one entry.
+    """
+    lock_chunk_orders(chunk)
+
+    context = frappe.flags.payment_tracking_bulk_submit = BulkSubmitContext()
+    submitted = []
+    failures = []
+
+    try:
+        for name in chunk:
+            frappe.db.savepoint("payment_tracking_bulk_submit")
+            context.begin_entry()
+            try:
+                payment_entry = frappe.get_doc("Payment Entry", name)
+                if payment_entry.docstatus != 0:
+                    frappe.throw(_("Payment Entry {0} is not a draft").format(name))
+
+                payment_entry.submit()
+                context.accept_entry()
+                submitted.append(name)
+            except Exception as e:
+                if is_lock_conflict(e):
+                    raise
+                frappe.db.rollback(save_point="payment_tracking_bulk_submit")
+                context.discard_entry()
+                failures.append((name, e))
+            finally:
+                frappe.local.message_log = []
+    finally:
+        frappe.flags.payment_tracking_bulk_submit = None
+
+    apply_payment_schedule_deltas(context.row_deltas)
+    invalidate_schedule()
+    update_staged_total_payments(context.total_documents)
+    frappe.db.commit()
+
+    return submitted, failures
+
+
+def lock_chunk_orders(chunk):
+    """Take the advisory locks of every Order the chunk's entries reference, in one sorted pass"""
+    references = frappe.get_all(
+        "Payment Entry Reference",
+        filters={"parent": ["in", chunk], "parenttype": "Payment Entry"},
+        fields=["reference_doctype", "reference_name"],
+        distinct=True,
+    )
+    lock_orders((ref.reference_doctype, ref.reference_name) for ref in references)
+
+
+def add_failure(summary, name, error):
+    summary["failed"] += 1
+    if len(summary["failures"]) < MAX_REPORTED_FAILURES:
+        summary["failures"].append({"name": name, "error": str(error)})
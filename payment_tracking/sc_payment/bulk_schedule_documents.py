@@ -0,0 +1,264 @@
+"""
+Bulk creation of documents from Order Payment Schedules
+
+Background jobs that select every due, unlinked schedule row with one query
+and create documents for them in committed batches:
+
+- generate_payment_requests: one Payment Request per advance (non-last) row,
+  through create_from_schedule_row, so the usual locking and availability
+  rules apply
+- generate_final_invoices: one draft Invoice per Order whose last row is
+  due, mapped with ERPNext's make_*_invoice; the batch's rows are locked up
+  front and linked with one UPDATE per batch instead of a write per invoice
+
+Each row runs under its own savepoint: a failure is rolled back, recorded
+in the summary and the batch goes on; a batch that hits a deadlock is rolled
+back and retried as a whole. Messages are muted while the job runs.
+Progress per batch (documents, failures, docs/sec) is published as the
+`payment_tracking_bulk_progress` realtime event; the final summary is
+returned, logged and published as `payment_tracking_bulk_done`.
+"""
+
+import time
+
+import frappe
+from frappe import _
+from frappe.utils import cint, getdate, nowdate
+
+from payment_tracking.sc_payment.deadlocks import is_lock_conflict, retry_on_deadlock
+from payment_tracking.sc_payment.order_locks import lock_orders
+from payment_tracking.sc_payment.schedule_cache import invalidate_schedule
+from payment_tracking.sc_payment.schedule_documents import (
+    SCHEDULE_DOCUMENT_MAP,
+    create_from_schedule_row,
+    make_invoice,
+)
+
+BULK_BATCH_SIZE = 100
+
+# Failures kept in the summary (all of them are counted)
+MAX_REPORTED_FAILURES = 200
+
+BULK_PROGRESS_EVENT = "payment_tracking_bulk_progress"
+BULK_DONE_EVENT = "payment_tracking_bulk_done"
+
+# Orders in these states get no new documents
+CLOSED_ORDER_STATUSES = ("Closed", "Completed", "On Hold")
+
+
+def get_due_schedule_rows(order_doctype, due_date=None, last_row=False, orders=None):
+    """
+    Return due, unlinked schedule rows of submitted, open Orders as
+    [{name, parent, idx, due_date}] ordered by Order and idx, with one query.
+
+    last_row selects only each Order's last row; otherwise only the advance
+    (non-last) rows are returned.
+    """
+    if order_doctype not in SCHEDULE_DOCUMENT_MAP:
+        frappe.throw(_("Documents from schedule are not supported for {0}").format(order_doctype))
+
+    params = {
+        "parenttype": order_doctype,
+        "due_date": getdate(due_date or nowdate()),
+        "closed_statuses": CLOSED_ORDER_STATUSES,
+    }
+
+    orders_condition = ""
+    if orders:
+        orders_condition = "AND ps.parent IN %(orders)s"
+        params["orders"] = tuple(orders)
+
+    return frappe.db.sql(f"""
+        SELECT ps.name, ps.parent, ps.idx, ps.due_date
+        FROM `tabPayment Schedule` ps
+        INNER JOIN `tab{order_doctype}` o ON o.name = ps.parent
+        INNER JOIN (
+            SELECT parent, MAX(idx) AS last_idx
+            FROM `tabPayment Schedule`
+            WHERE parenttype = %(parenttype)s AND parentfield = 'payment_schedule'
+            GROUP BY parent
+        ) last_rows ON last_rows.parent = ps.parent
+        WHERE ps.parenttype = %(parenttype)s
+            AND ps.parentfield = 'payment_schedule'
+            AND ps.due_date <= %(due_date)s
+            AND IFNULL(ps.custom_invoice_name, '') = ''
+            AND ps.idx {"=" if last_row else "<"} last_rows.last_idx
+            AND o.docstatus = 1
+            AND o.status NOT IN %(closed_statuses)s
+            {orders_condition}
+        ORDER BY ps.parent, ps.idx
+    """, params, as_dict=True)
+
+
+def generate_payment_requests(order_doctype, due_date=None, submit=False, batch_size=BULK_BATCH_SIZE, notify_user=None):
+    """Background job: create Payment Requests for every due, unlinked advance schedule row"""
+    rows = get_due_schedule_rows(order_doctype, due_date)
+
+    def create(row):
+        return create_from_schedule_row(order_doctype, row.parent, row.idx, submit=cint(submit))["name"]
+
+    return run_in_batches(
+        _("Payment Requests for {0}").format(_(order_doctype)), rows, create, batch_size, notify_user
+    )
+
+
+def generate_final_invoices(order_doctype, due_date=None, batch_size=BULK_BATCH_SIZE, notify_user=None):
+    """Background job: create draft Invoices for Orders whose last schedule row is due and unlinked"""
+    rows = get_due_schedule_rows(order_doctype, due_date, last_row=True)
+    settings = SCHEDULE_DOCUMENT_MAP[order_doctype]
+
+    def start_batch(batch):
+        # Lock the batch's Orders and rows; rows linked meanwhile by someone else are skipped
+        lock_orders((order_doctype, row.parent) for row in batch)
+        free_rows = set(frappe.db.sql_list("""
+            SELECT name FROM `tabPayment Schedule`
+            WHERE name IN %(names)s AND IFNULL(custom_invoice_name, '') = ''
+            ORDER BY parent, idx
+            FOR UPDATE
+        """, {"names": tuple(row.name for row in batch)}))
+        return [row for row in batch if row.name in free_rows]
+
+    def create(row):
+        return make_invoice(row.parent, row, settings).name
+
+    def finish_batch(created):
+        link_schedule_rows(settings.invoice_doctype, {row.name: name for row, name in created})
+        invalidate_schedule({row.parent for row, _name in created})
+
+    return run_in_batches(
+        _("{0} for {1}").format(_(settings.invoice_doctype), _(order_doctype)),
+        rows,
+        create,
+        batch_size,
+        notify_user,
+        start_batch=start_batch,
+        finish_batch=finish_batch,
+    )
+
+
+def link_schedule_rows(link_doctype, links):
+    """Set {schedule row name: document name} links with one CASE-keyed UPDATE"""
+    if not links:
+        return
+
+    row_names = list(links)
+    values = [link_doctype]
+    for row_name in row_names:
+        values.extend((row_name, links[row_name]))
+    values.extend(row_names)
+
+    frappe.db.sql(f"""
+        UPDATE `tabPayment Schedule`
+        SET custom_invoice_doctype = %s,
+            custom_invoice_name = CASE name {" ".join(["WHEN %s THEN %s"] * len(row_names))} END
+        WHERE name IN ({", ".join(["%s"] * len(row_names))})
+    """, values)
+
+
+def run_in_batches(title, rows, create, batch_size, notify_user=None, start_batch=None, finish_batch=None):
+    """
+    Call create(row) for every row, committing every batch_size rows and
+    isolating each row with a savepoint. start_batch(rows) may narrow a batch
+    before it runs; finish_batch([(row, created name)]) runs before the commit.
+
+    Returns {title, rows, created, skipped, failed, failures, elapsed_seconds, docs_per_sec}.
+    """
+    batch_size = max(cint(batch_size), 1)
+    summary = {"title": title, "rows": len(rows), "created": 0, "skipped": 0, "failed": 0, "failures": []}
+    started = time.monotonic()
+
+    mute_messages = frappe.flags.mute_messages
+    frappe.flags.mute_messages = True
+
+    try:
+        for start in range(0, len(rows), batch_size):
+            batch_started = time.monotonic()
+            batch = rows[start:start + batch_size]
+            failed_before = summary["failed"]
+
+            try:
+                created, skipped, failures = retry_on_deadlock(
+                    "bulk_schedule_documents", run_batch, batch, create, start_batch, finish_batch
+                )
+            except Exception as e:
+                # The batch's shared writes failed: none of its documents were kept
+                frappe.db.rollback()
+                invalidate_schedule()
+                created, skipped, failures = [], 0, [(row, e) for row in batch]
+
+            for row, error in failures:
+                add_failure(summary, row, error)
+
+            summary["skipped"] += skipped
+            batch_created = len(created)
+            summary["created"] += batch_created
+
+            batch_seconds = time.monotonic() - batch_started
+            frappe.publish_realtime(BULK_PROGRESS_EVENT, {
+                "title": title,
+                "done": min(start + batch_size, len(rows)),
+                "total": len(rows),
+                "created": summary["created"],
+                "skipped": summary["skipped"],
+                "failed": summary["failed"],
+                "batch_failed": summary["failed"] - failed_before,
+                "batch_docs_per_sec": round(batch_created / batch_seconds, 1) if batch_seconds else None,
+            }, user=notify_user)
+    finally:
+        frappe.flags.mute_messages = mute_messages
+
+    elapsed = time.monotonic() - started
+    summary["elapsed_seconds"] = round(elapsed, 1)
+    summary["docs_per_sec"] = round(summary["created"] / elapsed, 1) if elapsed else None
+
+    if summary["failed"]:
+        frappe.log_error(
+            message=frappe.as_json(summary),
+            title=f"Payment Tracking Bulk: {summary['failed']} of {summary['rows']} failed"
+        )
+
+    frappe.publish_realtime(BULK_DONE_EVENT, summary, user=notify_user)
+    return summary
+
+
+def run_batch(batch, create, start_batch=None, finish_batch=None):
+    """
+    Create the documents of one batch and commit them.
+    Returns ([(row, created name)], skipped rows, [(row, error)]).
+
+    A deadlock aborts the whole transaction, so it is raised for the caller
+    to retry the batch instead of being recorded against one row.
+    """
+    skipped = 0
+    if start_batch:
+        narrowed = start_batch(batch)
+        skipped = len(batch) - len(narrowed)
+        batch = narrowed
+
+    created = []
+    failures = []
+    for row in batch:
+        frappe.db.savepoint("payment_tracking_bulk_row")
+        try:
+            created.append((row, create(row)))
+        except Exception as e:
+            if is_lock_conflict(e):
+                raise
+            frappe.db.rollback(save_point="payment_tracking_bulk_row")
+            invalidate_schedule([row.parent])
+            failures.append((row, e))
+        finally:
+            frappe.local.message_log = []
+
+    if finish_batch and created:
+        finish_batch(created)
+
+    frappe.db.commit()
+
+    return created, skipped, failures
+
+
+def add_failure(summary, row, error):
+    summary["failed"] += 1
+    if len(summary["failures"]) < MAX_REPORTED_FAILURES:
+        summary["failures"].append({"order": row.parent, "idx": row.idx, "error": str(error)})
@@ -25,6 +25,17 @@ def create_payment_tracking_fields():
                 "insert_after": "payment_schedule",
                 "description": "Skip automatic recalculation of Payment Schedule amounts",
                 "translatable": 0
+            },
+            {
+                "fieldname": "custom_payment_requested_amount",
+                "label": "Payment Requested Amount",
+                "fieldtype": "Currency",
+                "options": "currency",
+                "read_only": 1,
+                "no_copy": 1,
+                "allow_on_submit": 1,
+                "precision": 2,
+                "insert_after": "custom_total_payment"
             }
         ],
         "Sales Order": [
@@ -38,6 +49,17 @@ def create_payment_tracking_fields():
                 "insert_after": "rounded_total",
                 "in_list_view": 1,
                 "in_standard_filter": 1
+            },
+            {
+                "fieldname": "custom_payment_requested_amount",
+                "label": "Payment Requested Amount",
+                "fieldtype": "Currency",
+                "options": "currency",
+                "read_only": 1,
+                "no_copy": 1,
+                "allow_on_submit": 1,
+                "precision": 2,
+                "insert_after": "custom_total_payment"
             }
         ],
         "Purchase Invoice": [
@@ -58,6 +80,17 @@ def create_payment_tracking_fields():
                 "fieldtype": "HTML",
                 "read_only": 1,
                 "insert_after": "custom_total_payment"
+            },
+            {
+                "fieldname": "custom_document_links_data",
+                "label": "Document Links Data",
+                "fieldtype": "JSON",
+                "read_only": 1,
+                "hidden": 1,
+                "no_copy": 1,
+                "print_hide": 1,
+                "allow_on_submit": 1,
+                "insert_after": "custom_document_links_details"
             }
         ],
         "Sales Invoice": [
@@ -80,6 +113,17 @@ def create_payment_tracking_fields():
                 "fieldtype": "HTML",
                 "read_only": 1,
                 "insert_after": "total_allocated_amount"
+            },
+            {
+                "fieldname": "custom_document_links_data",
+                "label": "Document Links Data",
+                "fieldtype": "JSON",
+                "read_only": 1,
+                "hidden": 1,
+                "no_copy": 1,
+                "print_hide": 1,
+                "allow_on_submit": 1,
+                "insert_after": "custom_document_links_details"
             }
         ],
         "Payment Request": [
@@ -0,0 +1,60 @@
+"""
+Bounded retry on deadlocks and lock-wait timeouts
+
+Writers lock rows in one global order - Payment Schedule rows by
+(parent, idx), documents by (doctype, name) - which removes most deadlocks
+between concurrent Payment Entries. The rest (e.g. against ERPNext's own
+writes) are retried here.
+
+Only whole transactions can be retried: InnoDB rolls back the entire
+transaction of a deadlock victim, so retry_on_deadlock() is used only where
+this app owns the transaction (background jobs, bulk APIs), around a unit of
+work that commits itself. Request hooks are never retried.
+
+Counters (see payment_tracking.sc_payment.metrics): `deadlock_retries`,
+`deadlock_retries:<label>` and `deadlock_giveups`.
+"""
+
+import random
+import time
+
+import frappe
+
+from payment_tracking.sc_payment import metrics
+from payment_tracking.sc_payment.schedule_cache import invalidate_schedule
+
+DEADLOCK_ATTEMPTS = 3
+
+# Base backoff in seconds; attempt n waits about n * DEADLOCK_BACKOFF plus jitter
+DEADLOCK_BACKOFF = 0.2
+
+
+def is_lock_conflict(e):
+    """True for deadlocks and lock-wait timeouts (frappe.db.sql raises these as its own exceptions)"""
+    return isinstance(e, frappe.QueryDeadlockError | frappe.QueryTimeoutError)
+
+
+def retry_on_deadlock(label, fn, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs), a unit of work that commits itself. On a
+    deadlock or lock-wait timeout roll back and run it again, up to
+    DEADLOCK_ATTEMPTS times in total, then re-raise.
+    """
+    for attempt in range(1, DEADLOCK_ATTEMPTS + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if not is_lock_conflict(e):
+                raise
+
+            frappe.db.rollback()
+            invalidate_schedule()
+
+            if attempt == DEADLOCK_ATTEMPTS:
+                metrics.incr("deadlock_giveups")
+                raise
+
+            metrics.incr("deadlock_retries")
+            metrics.incr(f"deadlock_retries:{label}")
+            time.sleep(attempt * DEADLOCK_BACKOFF + random.uniform(0, DEADLOCK_BACKOFF))
+
@@ -0,0 +1,10 @@
+# Copyright (c) 2026, SwissCluster and contributors
+# For license information, please see license.txt
+
+from frappe.model.document import Document
+
+
+class OrderInvoiceLink(Document):
+    """Materialized Order <-> Invoice link, see payment_tracking.sc_payment.order_invoice_links"""
+
+    pass
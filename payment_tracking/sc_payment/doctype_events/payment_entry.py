@@ -1,52 +1,97 @@
 # payment_tracking/payment_tracking/sc_payment/doctype_events/payment_entry.py
 import frappe
-from frappe import _
+from frappe.utils import cint
 # import debugpy
 
-
+from payment_tracking.sc_payment.deadlocks import is_lock_conflict
+from payment_tracking.sc_payment.instrumentation import instrumented
+from payment_tracking.sc_payment.order_invoice_links import (
+    INVOICE_ORDER_MAP,
+    ORDER_INVOICE_MAP,
+    get_invoices_for_orders,
+    get_orders_for_invoices,
+)
+from payment_tracking.sc_payment.payment_totals import (
+    apply_payment_entry_delta,
+    defer_documents_total_payment,
+    get_total_payment_mode,
+    update_documents_total_payment,
+)
+from payment_tracking.sc_payment.recalculation import start_recalculation
+from payment_tracking.sc_payment.schedule_cache import get_schedule_rows
+
+
+@instrumented
 def populate_payment_schedule_idx(doc, method=None):
     """
     Before submit: set custom_payment_schedule_idx on each Payment Entry Reference row.
     This maps each reference to the correct Payment Schedule row by idx,
     fixing the bug where duplicate payment_term values cause all matching rows to be updated.
+
+    Each reference gets the first schedule row (by idx) with its payment_term that is not
+    already assigned to another reference. Candidate rows of all referenced documents are
+    fetched once (shared with update_payment_schedule through the schedule cache) and
+    walked with one cursor per (reference_name, payment_term).
     """
-    for ref in doc.get("references"):
-        if not ref.payment_term or not ref.reference_name:
-            continue
+    references = [ref for ref in doc.get("references") if ref.payment_term and ref.reference_name]
+    pending = [ref for ref in references if not ref.get("custom_payment_schedule_idx")]
+
+    if not pending:
+        return
 
+    # idx values already taken per (reference_name, payment_term)
+    assigned_idxs = {}
+    for ref in references:
         if ref.get("custom_payment_schedule_idx"):
-            continue
-
-        # Find the matching Payment Schedule row by payment_term
-        # If multiple rows share the same payment_term, pick the first one
-        # that hasn't already been assigned to another reference
-        assigned_idxs = {
-            r.get("custom_payment_schedule_idx")
-            for r in doc.get("references")
-            if r.get("custom_payment_schedule_idx")
-            and r.reference_name == ref.reference_name
-            and r.payment_term == ref.payment_term
-        }
-
-        schedule_rows = frappe.get_all(
-            "Payment Schedule",
-            filters={"parent": ref.reference_name, "payment_term": ref.payment_term},
-            fields=["idx"],
-            order_by="idx asc",
-        )
+            key = (ref.reference_name, ref.payment_term)
+            assigned_idxs.setdefault(key, set()).add(ref.custom_payment_schedule_idx)
+
+    schedule_idxs = {}
+    for rows in get_schedule_rows({ref.reference_name for ref in pending}).values():
+        for row in rows:
+            schedule_idxs.setdefault((row.parent, row.payment_term), []).append(row.idx)
+
+    cursors = {}
+    for ref in pending:
+        key = (ref.reference_name, ref.payment_term)
+        candidates = schedule_idxs.get(key, [])
+        taken = assigned_idxs.setdefault(key, set())
 
-        for row in schedule_rows:
-            if row.idx not in assigned_idxs:
-                ref.custom_payment_schedule_idx = row.idx
-                break
+        # Taken idxs only grow, so the first free idx never moves backwards
+        position = cursors.get(key, 0)
+        while position < len(candidates) and candidates[position] in taken:
+            position += 1
 
+        if position < len(candidates):
+            ref.custom_payment_schedule_idx = candidates[position]
+            taken.add(candidates[position])
+            position += 1
 
+        cursors[key] = position
+
+
+@instrumented
 def update_total_payments(doc, method=None):
     """Update total payment amounts in related documents when Payment Entry changes"""
 
     if not doc.references:
         return
-        
+
+    # Bulk submit: affected documents are recomputed once per chunk
+    bulk = frappe.flags.payment_tracking_bulk_submit
+    if bulk and method == "on_submit":
+        bulk.stage_total_documents(
+            (ref.reference_doctype, ref.reference_name)
+            for ref in doc.references
+            if ref.reference_doctype in ["Purchase Order", "Sales Order", "Purchase Invoice", "Sales Invoice"]
+        )
+        return
+
+    # Submit and cancel change totals by exactly this entry's allocations
+    if get_total_payment_mode() == "incremental" and method in ("on_submit", "on_cancel"):
+        apply_payment_entry_delta(doc, 1 if method == "on_submit" else -1)
+        return
+
     # Get all unique reference documents (direct references)
     reference_docs = {}
     for ref in doc.references:
@@ -64,207 +109,133 @@ def update_total_payments(doc, method=None):
     # Combine direct and indirect references
     all_docs = {**reference_docs, **indirect_docs}
     
-    # Update total payments for each referenced document
-    for _ref_key, ref_data in all_docs.items():
+    # Recompute after commit in background jobs
+    if get_total_payment_mode() == "deferred":
+        defer_documents_total_payment((ref_data["doctype"], ref_data["name"]) for ref_data in all_docs.values())
+        return
+
+    # Recompute all affected documents in one batch (grouped query + multi-row UPDATE per doctype)
+    documents = [(ref_data["doctype"], ref_data["name"]) for ref_data in all_docs.values()]
+    frappe.db.savepoint("payment_tracking_totals")
+    try:
+        update_documents_total_payment(documents)
+    except Exception as e:
+        # Lock conflicts fail the submit: the transaction (or its locks) cannot be trusted
+        if is_lock_conflict(e):
+            raise
+        frappe.db.rollback(save_point="payment_tracking_totals")
+        update_documents_total_payment_one_by_one(doc, documents)
+
+
+def update_documents_total_payment_one_by_one(doc, documents):
+    """Fallback after a failed batch: update each document alone, so one bad document does not stall the rest"""
+    for doctype, name in documents:
+        frappe.db.savepoint("payment_tracking_total")
         try:
-            update_document_total_payment(ref_data["doctype"], ref_data["name"])
+            update_documents_total_payment([(doctype, name)])
         except Exception as e:
-            error_msg = f"Error updating total payment for {ref_data['doctype']} {ref_data['name']}: {e!s}"
+            if is_lock_conflict(e):
+                raise
+            frappe.db.rollback(save_point="payment_tracking_total")
+            error_msg = f"Error updating total payment of {doctype} {name} for Payment Entry {doc.name}: {e!s}"
             frappe.log_error(error_msg, "Payment Tracking Error")
 
-def find_indirect_references(direct_refs):
-    """Find Orders that are indirectly referenced through Invoices"""
+
+def update_staged_total_payments(documents):
+    """
+    Recompute (or defer) totals for directly referenced (doctype, name) pairs
+    staged by a bulk submit, plus the documents linked to them, once each.
+    """
+    reference_docs = {
+        f"{doctype}::{name}": {"doctype": doctype, "name": name}
+        for doctype, name in sorted(documents)
+        if name
+    }
+    if not reference_docs:
+        return
+
+    all_docs = {**reference_docs, **find_indirect_references(reference_docs)}
+    documents = sorted((ref_data["doctype"], ref_data["name"]) for ref_data in all_docs.values())
+
+    if get_total_payment_mode() == "deferred":
+        defer_documents_total_payment(documents)
+    else:
+        update_documents_total_payment(documents)
+
+def find_indirect_references(direct_refs, depth=None):
+    """
+    Find documents indirectly referenced through the Order Invoice Link index:
+    Orders linked to referenced Invoices and Invoices linked to referenced Orders.
+
+    References are grouped by doctype and resolved with one IN query per
+    doctype per hop. depth > 1 keeps expanding from the newly found documents
+    (Order -> Invoice -> other Orders ...); it defaults to the site config
+    `payment_tracking_reference_depth` or 1.
+    """
+
+    depth = cint(depth or frappe.conf.get("payment_tracking_reference_depth") or 1)
 
     indirect_docs = {}
+    seen = set(direct_refs)
+
+    frontier = {}
+    for ref_data in direct_refs.values():
+        frontier.setdefault(ref_data["doctype"], set()).add(ref_data["name"])
+
+    for _hop in range(depth):
+        next_frontier = {}
+
+        for doctype, docnames in frontier.items():
+            # Invoice -> Orders
+            if doctype in INVOICE_ORDER_MAP:
+                linked_doctype = INVOICE_ORDER_MAP[doctype][0]
+                linked = get_orders_for_invoices(doctype, docnames)
+
+            # Order -> Invoices
+            elif doctype in ORDER_INVOICE_MAP:
+                linked_doctype = ORDER_INVOICE_MAP[doctype]
+                linked = get_invoices_for_orders(doctype, docnames)
+
+            else:
+                continue
+
+            for linked_names in linked.values():
+                for linked_name in linked_names:
+                    key = f"{linked_doctype}::{linked_name}"
+                    if key in seen:
+                        continue
+
+                    seen.add(key)
+                    indirect_docs[key] = {
+                        "doctype": linked_doctype,
+                        "name": linked_name
+                    }
+                    next_frontier.setdefault(linked_doctype, set()).add(linked_name)
+
+        if not next_frontier:
+            break
+
+        frontier = next_frontier
 
-    for _key, ref_data in direct_refs.items():
-        doctype = ref_data["doctype"]
-        docname = ref_data["name"]
-        
-        # If Payment Entry references an Invoice, find the related Order(s)
-        if doctype == "Sales Invoice":
-            # Get Sales Orders linked to this Sales Invoice
-            linked_orders = frappe.db.sql("""
-                SELECT DISTINCT si_item.sales_order as order_name
-                FROM `tabSales Invoice Item` si_item
-                WHERE si_item.parent = %(invoice_name)s 
-                AND si_item.sales_order IS NOT NULL
-                AND si_item.sales_order != ''
-            """, {"invoice_name": docname}, as_dict=True)
-            
-            for order in linked_orders:
-                if order.order_name:
-                    key = f"Sales Order::{order.order_name}"
-                    if key not in indirect_docs:
-                        indirect_docs[key] = {
-                            "doctype": "Sales Order",
-                            "name": order.order_name
-                        }
-        
-        elif doctype == "Purchase Invoice":
-            # Get Purchase Orders linked to this Purchase Invoice
-            linked_orders = frappe.db.sql("""
-                SELECT DISTINCT pi_item.purchase_order as order_name
-                FROM `tabPurchase Invoice Item` pi_item
-                WHERE pi_item.parent = %(invoice_name)s 
-                AND pi_item.purchase_order IS NOT NULL
-                AND pi_item.purchase_order != ''
-            """, {"invoice_name": docname}, as_dict=True)
-            
-            for order in linked_orders:
-                if order.order_name:
-                    key = f"Purchase Order::{order.order_name}"
-                    if key not in indirect_docs:
-                        indirect_docs[key] = {
-                            "doctype": "Purchase Order",
-                            "name": order.order_name
-                        }
-        
-        # If Payment Entry references an Order, find related Invoices
-        elif doctype == "Sales Order":
-            # Get Sales Invoices linked to this Sales Order
-            linked_invoices = frappe.db.sql("""
-                SELECT DISTINCT si_item.parent as invoice_name
-                FROM `tabSales Invoice Item` si_item
-                WHERE si_item.sales_order = %(order_name)s
-                AND si_item.parent IS NOT NULL
-                AND si_item.parent != ''
-            """, {"order_name": docname}, as_dict=True)
-            
-            for invoice in linked_invoices:
-                if invoice.invoice_name:
-                    key = f"Sales Invoice::{invoice.invoice_name}"
-                    if key not in indirect_docs:
-                        indirect_docs[key] = {
-                            "doctype": "Sales Invoice",
-                            "name": invoice.invoice_name
-                        }
-        
-        elif doctype == "Purchase Order":
-            # Get Purchase Invoices linked to this Purchase Order
-            linked_invoices = frappe.db.sql("""
-                SELECT DISTINCT pi_item.parent as invoice_name
-                FROM `tabPurchase Invoice Item` pi_item
-                WHERE pi_item.purchase_order = %(order_name)s
-                AND pi_item.parent IS NOT NULL
-                AND pi_item.parent != ''
-            """, {"order_name": docname}, as_dict=True)
-            
-            for invoice in linked_invoices:
-                if invoice.invoice_name:
-                    key = f"Purchase Invoice::{invoice.invoice_name}"
-                    if key not in indirect_docs:
-                        indirect_docs[key] = {
-                            "doctype": "Purchase Invoice",
-                            "name": invoice.invoice_name
-                        }
-    
     return indirect_docs
 
 def update_document_total_payment(doctype, docname):
     """Calculate and update total payment for a specific document"""
-    
-    # Get direct payments to this document
-    direct_payments = frappe.db.sql("""
-        SELECT 
-            pe.name,
-            pe.docstatus,
-            per.allocated_amount,
-            pe.payment_type
-        FROM `tabPayment Entry` pe
-        INNER JOIN `tabPayment Entry Reference` per ON pe.name = per.parent
-        WHERE 
-            per.reference_doctype = %(doctype)s 
-            AND per.reference_name = %(docname)s
-            AND pe.docstatus = 1
-    """, {
-        "doctype": doctype,
-        "docname": docname
-    }, as_dict=True)
-    
-    
-    # Get indirect payments (for Orders through related Invoices)
-    indirect_payments = []
-    if doctype == "Sales Order":
-        # Get payments to Sales Invoices linked to this Sales Order
-        indirect_payments = frappe.db.sql("""
-            SELECT DISTINCT
-                pe.name,
-                pe.docstatus,
-                per.allocated_amount,
-                pe.payment_type
-            FROM `tabPayment Entry` pe
-            INNER JOIN `tabPayment Entry Reference` per ON pe.name = per.parent
-            INNER JOIN `tabSales Invoice Item` si_item ON per.reference_name = si_item.parent
-            WHERE 
-                per.reference_doctype = 'Sales Invoice'
-                AND si_item.sales_order = %(docname)s
-                AND pe.docstatus = 1
-        """, {"docname": docname}, as_dict=True)
-        
-    elif doctype == "Purchase Order":
-        # Get payments to Purchase Invoices linked to this Purchase Order
-        indirect_payments = frappe.db.sql("""
-            SELECT DISTINCT
-                pe.name,
-                pe.docstatus,
-                per.allocated_amount,
-                pe.payment_type
-            FROM `tabPayment Entry` pe
-            INNER JOIN `tabPayment Entry Reference` per ON pe.name = per.parent
-            INNER JOIN `tabPurchase Invoice Item` pi_item ON per.reference_name = pi_item.parent
-            WHERE 
-                per.reference_doctype = 'Purchase Invoice'
-                AND pi_item.purchase_order = %(docname)s
-                AND pe.docstatus = 1
-        """, {"docname": docname}, as_dict=True)
-    
-    
-    # Combine direct and indirect payments
-    all_payments = direct_payments + indirect_payments
-    
-    total_payment = 0
-    
-    # Calculate total from all payment entries
-    for pe in all_payments:
-        amount = pe.allocated_amount or 0
-        if pe.payment_type in ["Receive", "Pay"]:
-            total_payment += amount
-    
-    # Check if the custom field exists
-    if not frappe.db.has_column(doctype, "custom_total_payment"):
-        frappe.throw(f"Custom field 'custom_total_payment' not found in {doctype}. Please reinstall the app.")
-        return
-    
-    # Update the document
-    frappe.db.set_value(
-        doctype, 
-        docname, 
-        "custom_total_payment", 
-        total_payment,
-        update_modified=False
-    )
-    
+
+    update_documents_total_payment([(doctype, docname)])
+
     frappe.db.commit()
 
 @frappe.whitelist()
-def recalculate_all_payments():
-    """Utility function to recalculate all payment totals"""
-    
-    doctypes = ["Purchase Order", "Sales Order", "Purchase Invoice", "Sales Invoice"]
-    
-    for doctype in doctypes:
-        documents = frappe.get_all(doctype, fields=["name"])
-        
-        for doc in documents:
-            try:
-                update_document_total_payment(doctype, doc.name)
-            except Exception as e:
-                frappe.log_error(
-                    f"Error recalculating {doctype} {doc.name}: {e!s}",
-                    "Payment Tracking Recalculation Error"
-                )
-    
-    return _("Payment totals recalculated successfully")
+@instrumented
+def recalculate_all_payments(restart=False, engine="jobs", doctype=None):
+    """
+    Utility function to recalculate all payment totals.
 
+    Runs as chunked, resumable background jobs (see sc_payment/recalculation.py);
+    an interrupted run is resumed unless restart is set. engine="sql" runs the
+    set-based rebuild instead, optionally for a single doctype.
+    """
+    frappe.only_for("System Manager")
 
+    return start_recalculation(restart=cint(restart), engine=engine, doctype=doctype)
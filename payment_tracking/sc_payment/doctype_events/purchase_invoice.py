@@ -2,10 +2,13 @@
 Purchase Invoice payment schedule customizations
 """
 
-import frappe
 from frappe.utils import flt
 
+from payment_tracking.sc_payment.instrumentation import instrumented
+from payment_tracking.sc_payment.schedule_cache import get_schedule
 
+
+@instrumented
 def before_save(doc, method):
     """
     Fix payment schedule when inherited from a PO.
@@ -37,13 +40,8 @@ def before_save(doc, method):
     # Fetch original payment_amount values from PO
     po_schedule_map = {}
     if po_name:
-        po_schedule = frappe.get_all(
-            "Payment Schedule",
-            filters={"parent": po_name},
-            fields=["idx", "payment_amount", "base_payment_amount", "payment_term"],
-            order_by="idx"
-        )
-        for ps in po_schedule:
+        # Shared with before_submit through the schedule cache
+        for ps in get_schedule(po_name):
             po_schedule_map[ps.idx] = ps
 
     for row in doc.payment_schedule:
@@ -63,6 +61,7 @@ def before_save(doc, method):
         row.base_outstanding = flt(row.base_payment_amount) - flt(row.base_paid_amount)
 
 
+@instrumented
 def before_submit(doc, method):
     """
     Fix payment schedule before submit.
@@ -84,13 +83,7 @@ def before_submit(doc, method):
         return
 
     # Fetch original payment_amount values from PO
-    po_schedule = frappe.get_all(
-        "Payment Schedule",
-        filters={"parent": po_name},
-        fields=["idx", "payment_amount", "base_payment_amount"],
-        order_by="idx"
-    )
-    po_schedule_map = {ps.idx: ps for ps in po_schedule}
+    po_schedule_map = {ps.idx: ps for ps in get_schedule(po_name)}
 
     # Fix values in doc before save
     for row in doc.payment_schedule:
@@ -5,7 +5,10 @@ Purchase Order payment schedule customizations
 import frappe
 from frappe.utils import flt
 
+from payment_tracking.sc_payment.instrumentation import instrumented
 
+
+@instrumented
 def before_validate(doc, method):
     """
     Skip automatic payment schedule recalculation when manual mode is enabled.
@@ -24,6 +27,7 @@ def before_validate(doc, method):
         }
 
 
+@instrumented
 def validate(doc, method):
     """
     Restore manual payment amounts after standard validation has run.
@@ -0,0 +1,270 @@
+"""
+Document links for the Payment Entry / Invoice forms
+
+get_document_links() collects everything the "Document Links" HTML field
+shows for one document - party name, direct and indirect Orders, Invoices
+and Payment Requests - from a few narrow queries, without loading the
+document itself.
+"""
+
+import frappe
+from frappe import _
+
+from payment_tracking.sc_payment.instrumentation import instrumented
+from payment_tracking.sc_payment.order_invoice_links import INVOICE_ORDER_MAP, get_orders_for_invoices
+from payment_tracking.sc_payment.party_names import get_party_name
+
+# Invoice doctype -> party type
+INVOICE_PARTY_TYPES = {
+    "Sales Invoice": "Customer",
+    "Purchase Invoice": "Supplier",
+}
+
+
+def get_document_links(doctype, name, party_type=None, party=None):
+    """
+    Return {party_type, party, party_name, orders, invoices, payment_requests}
+    for a Payment Entry or Sales/Purchase Invoice.
+
+    orders and invoices are lists of {reference_doctype, reference_name};
+    orders also carry `direct` (referenced by the document itself, not
+    through an Invoice). party_type / party override the stored values, so
+    unsaved party changes on the form are reflected. A document that is not
+    saved yet only gets its party resolved.
+    """
+    links = get_links(doctype, name)
+
+    links["party_type"] = party_type or links.get("party_type")
+    links["party"] = party or links.get("party")
+    links["party_name"] = get_party_name(links["party_type"], links["party"])
+
+    return links
+
+
+def get_links(doctype, name):
+    """The stored link chain of a document, without the party name"""
+    if doctype == "Payment Entry":
+        return get_payment_entry_links(name)
+    if doctype in INVOICE_PARTY_TYPES:
+        return get_invoice_links(doctype, name)
+
+    frappe.throw(_("Document links are not available for {0}").format(doctype))
+
+
+def get_document_links_data(doctype, name):
+    """
+    JSON for custom_document_links_data. The party name is left out: it would
+    go stale on a Customer/Supplier rename, and the form has it in
+    party_name / supplier_name already.
+    """
+    return frappe.as_json(get_links(doctype, name), indent=None)
+
+
+def get_payment_entry_links(name):
+    header = frappe.db.get_value("Payment Entry", name, ["party_type", "party"], as_dict=True) or {}
+    links = {
+        "party_type": header.get("party_type"),
+        "party": header.get("party"),
+        "orders": [],
+        "invoices": [],
+        "payment_requests": [],
+    }
+    if not header:
+        return links
+
+    references = frappe.db.sql("""
+        SELECT reference_doctype, reference_name, payment_request
+        FROM `tabPayment Entry Reference`
+        WHERE parent = %(parent)s AND parenttype = 'Payment Entry'
+        ORDER BY idx
+    """, {"parent": name}, as_dict=True)
+
+    seen = set()
+    invoice_names = {}
+    for ref in references:
+        key = (ref.reference_doctype, ref.reference_name)
+        if ref.payment_request and ref.payment_request not in links["payment_requests"]:
+            links["payment_requests"].append(ref.payment_request)
+
+        if key in seen:
+            continue
+        seen.add(key)
+
+        if ref.reference_doctype in INVOICE_ORDER_MAP:
+            links["invoices"].append({"reference_doctype": ref.reference_doctype, "reference_name": ref.reference_name})
+            invoice_names.setdefault(ref.reference_doctype, []).append(ref.reference_name)
+        elif ref.reference_doctype in ("Purchase Order", "Sales Order"):
+            links["orders"].append(
+                {"reference_doctype": ref.reference_doctype, "reference_name": ref.reference_name, "direct": 1}
+            )
+
+    # Orders reached through the referenced Invoices, one query per invoice doctype
+    for invoice_doctype, names in invoice_names.items():
+        order_doctype = INVOICE_ORDER_MAP[invoice_doctype][0]
+        orders_by_invoice = get_orders_for_invoices(invoice_doctype, names)
+        for invoice_name in names:
+            for order_name in orders_by_invoice.get(invoice_name, []):
+                if (order_doctype, order_name) in seen:
+                    continue
+                seen.add((order_doctype, order_name))
+                links["orders"].append(
+                    {"reference_doctype": order_doctype, "reference_name": order_name, "direct": 0}
+                )
+
+    links["payment_requests"] = [{"name": pr} for pr in links["payment_requests"]]
+    return links
+
+
+def get_invoice_orders(payment_entry_name):
+    """
+    Orders reached through the Invoices a Payment Entry references, in
+    reference order and without duplicates. An Order the entry also
+    references directly is included.
+    """
+    references = frappe.get_all(
+        "Payment Entry Reference",
+        filters={
+            "parent": payment_entry_name,
+            "parenttype": "Payment Entry",
+            "reference_doctype": ["in", list(INVOICE_ORDER_MAP)],
+        },
+        fields=["reference_doctype", "reference_name"],
+        order_by="idx",
+    )
+
+    orders_by_invoice = {}
+    for invoice_doctype in {ref.reference_doctype for ref in references}:
+        names = [ref.reference_name for ref in references if ref.reference_doctype == invoice_doctype]
+        orders_by_invoice[invoice_doctype] = get_orders_for_invoices(invoice_doctype, names)
+
+    orders = []
+    seen = set()
+    for ref in references:
+        order_doctype = INVOICE_ORDER_MAP[ref.reference_doctype][0]
+        for order_name in orders_by_invoice[ref.reference_doctype].get(ref.reference_name, []):
+            if (order_doctype, order_name) in seen:
+                continue
+            seen.add((order_doctype, order_name))
+            orders.append({"reference_doctype": order_doctype, "reference_name": order_name})
+
+    return orders
+
+
+def get_invoice_links(doctype, name):
+    party_type = INVOICE_PARTY_TYPES[doctype]
+    party_field = party_type.lower()
+
+    links = {
+        "party_type": party_type,
+        "party": frappe.db.get_value(doctype, name, party_field),
+        "orders": [],
+        "invoices": [],
+        "payment_requests": [],
+    }
+    if not links["party"]:
+        return links
+
+    order_doctype = INVOICE_ORDER_MAP[doctype][0]
+    links["orders"] = [
+        {"reference_doctype": order_doctype, "reference_name": order_name, "direct": 1}
+        for order_name in get_orders_for_invoices(doctype, [name]).get(name, [])
+    ]
+    links["invoices"] = [{"reference_doctype": doctype, "reference_name": name}]
+    links["payment_requests"] = frappe.get_all(
+        "Payment Request",
+        filters={"reference_doctype": doctype, "reference_name": name, "docstatus": 1},
+        fields=["name", "status", "grand_total"],
+        order_by="creation asc",
+    )
+
+    return links
+
+
+
+# Doctypes that store their links in custom_document_links_data
+DOCUMENT_LINKS_DOCTYPES = ("Payment Entry", "Purchase Invoice")
+
+
+def store_document_links(doctype, names):
+    """Recompute and store custom_document_links_data for documents of one doctype"""
+    for name in dict.fromkeys(filter(None, names)):
+        frappe.db.set_value(
+            doctype,
+            name,
+            "custom_document_links_data",
+            get_document_links_data(doctype, name),
+            update_modified=False,
+        )
+
+
+@instrumented
+def update_document_links_data(doc, method=None):
+    """
+    Payment Entry / Purchase Invoice on_update (also runs on submit),
+    on_update_after_submit and on_cancel: store the link chain so the form renders without extra requests.
+    """
+    doc.db_set(
+        "custom_document_links_data",
+        get_document_links_data(doc.doctype, doc.name),
+        update_modified=False,
+    )
+
+
+@instrumented
+def refresh_payment_request_reference_links(doc, method=None):
+    """Payment Request on_submit / on_cancel: its Invoice lists submitted Payment Requests"""
+    if doc.reference_doctype in DOCUMENT_LINKS_DOCTYPES and doc.reference_name:
+        store_document_links(doc.reference_doctype, [doc.reference_name])
+
+
+@instrumented
+def remember_invoice_payment_entries(doc, method=None):
+    """
+    Invoice before_cancel: note the Payment Entries referencing the invoice,
+    since cancelling may unlink their reference rows.
+    """
+    doc.flags.payment_tracking_payment_entries = frappe.get_all(
+        "Payment Entry Reference",
+        filters={"reference_doctype": doc.doctype, "reference_name": doc.name, "parenttype": "Payment Entry"},
+        pluck="parent",
+        distinct=True,
+    )
+
+
+@instrumented
+def refresh_invoice_payment_entries(doc, method=None):
+    """Invoice on_cancel: refresh the links of the Payment Entries noted before cancel"""
+    store_document_links("Payment Entry", doc.flags.payment_tracking_payment_entries or [])
+
+
+def backfill_document_links_data(chunk_size=500):
+    """
+    Store custom_document_links_data on every non-cancelled Payment Entry and
+    Purchase Invoice that has none yet, committing per chunk.
+    Returns {doctype: documents updated}.
+    """
+    summary = {}
+
+    for doctype in DOCUMENT_LINKS_DOCTYPES:
+        summary[doctype] = 0
+        last_name = ""
+
+        while True:
+            names = frappe.db.sql_list(f"""
+                SELECT name FROM `tab{doctype}`
+                WHERE name > %(last_name)s AND docstatus < 2
+                    AND IFNULL(custom_document_links_data, '') = ''
+                ORDER BY name
+                LIMIT {int(chunk_size)}
+            """, {"last_name": last_name})
+
+            if not names:
+                break
+
+            store_document_links(doctype, names)
+            frappe.db.commit()
+
+            summary[doctype] += len(names)
+            last_name = names[-1]
+
+    return summary
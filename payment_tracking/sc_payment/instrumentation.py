@@ -0,0 +1,224 @@
+"""
+Latency and query-count instrumentation for hooks and whitelisted APIs
+
+Functions decorated with @instrumented record, per invocation, wall time,
+the number of SQL queries and the time spent in them. Nothing is measured
+unless site config `payment_tracking_instrumentation` is set; when it is off
+the wrapper costs one config lookup.
+
+While an instrumented call runs, frappe.db.sql is wrapped with a counter
+(installed by the outermost instrumented call, removed when it returns);
+nested calls are measured inclusively.
+
+Each invocation writes one JSON line to the `payment_tracking.instrumentation`
+log and is added to histograms kept per request/job and flushed to redis
+after it (see hooks.py), in WINDOW_SECONDS windows. get_prometheus_text()
+renders the last WINDOWS_KEPT windows in Prometheus text format.
+"""
+
+import functools
+import json
+import time
+
+import frappe
+
+WINDOW_SECONDS = 300
+WINDOWS_KEPT = 12
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Histogram -> (buckets, help text)
+HISTOGRAMS = {
+    "duration_seconds": (DURATION_BUCKETS, "Wall time per call"),
+    "sql_queries": (QUERY_BUCKETS, "SQL queries per call"),
+    "sql_seconds": (DURATION_BUCKETS, "Time spent in SQL per call"),
+}
+
+
+def is_enabled():
+    return bool(frappe.conf.get("payment_tracking_instrumentation"))
+
+
+def instrumented(fn):
+    """Measure every call of fn while instrumentation is enabled"""
+    name = f"{fn.__module__}.{fn.__qualname__}"
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not is_enabled():
+            return fn(*args, **kwargs)
+        return call_instrumented(name, fn, args, kwargs)
+
+    return wrapper
+
+
+def get_call_state():
+    state = getattr(frappe.local, "payment_tracking_instrumentation", None)
+    if state is None:
+        state = frappe.local.payment_tracking_instrumentation = frappe._dict(
+            depth=0, sql_count=0, sql_seconds=0.0, db=None, original_sql=None
+        )
+    return state
+
+
+def call_instrumented(name, fn, args, kwargs):
+    state = get_call_state()
+    if not state.depth:
+        install_sql_counter(state)
+
+    state.depth += 1
+    sql_count = state.sql_count
+    sql_seconds = state.sql_seconds
+    error = None
+    started = time.perf_counter()
+
+    try:
+        return fn(*args, **kwargs)
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        state.depth -= 1
+        if not state.depth:
+            remove_sql_counter(state)
+
+        record_call(name, duration, state.sql_count - sql_count, state.sql_seconds - sql_seconds, error)
+
+
+def install_sql_counter(state):
+    """Shadow frappe.db.sql with a counting wrapper on the current connection object"""
+    db = frappe.db
+    original_sql = db.sql
+
+    def counted_sql(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original_sql(*args, **kwargs)
+        finally:
+            state.sql_count += 1
+            state.sql_seconds += time.perf_counter() - started
+
+    # Keep an instance-level sql (another profiler's wrapper) to put back afterwards
+    state.db = db
+    state.original_sql = db.__dict__.get("sql")
+    db.sql = counted_sql
+
+
+def remove_sql_counter(state):
+    db = state.db
+    if db is None:
+        return
+
+    if state.original_sql is not None:
+        db.sql = state.original_sql
+    else:
+        db.__dict__.pop("sql", None)
+
+    state.db = state.original_sql = None
+
+
+def record_call(name, duration, sql_count, sql_seconds, error=None):
+    frappe.logger("payment_tracking.instrumentation").info(json.dumps({
+        "function": name,
+        "duration_ms": round(duration * 1000, 2),
+        "sql_queries": sql_count,
+        "sql_ms": round(sql_seconds * 1000, 2),
+        "error": error,
+        "user": frappe.session.user if getattr(frappe.local, "session", None) else None,
+    }))
+
+    stats = getattr(frappe.local, "payment_tracking_instrumentation_stats", None)
+    if stats is None:
+        stats = frappe.local.payment_tracking_instrumentation_stats = {}
+
+    for histogram, value in (("duration_seconds", duration), ("sql_queries", sql_count), ("sql_seconds", sql_seconds)):
+        observe(stats, name, histogram, value)
+
+
+def observe(stats, name, histogram, value):
+    buckets = HISTOGRAMS[histogram][0]
+    bucket = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+
+    for field, amount in (
+        (f"{name}|{histogram}|{bucket}", 1),
+        (f"{name}|{histogram}|sum", value),
+        (f"{name}|{histogram}|count", 1),
+    ):
+        stats[field] = stats.get(field, 0) + amount
+
+
+def get_window_key(window):
+    return frappe.cache.make_key(f"payment_tracking:instrumentation:{window}")
+
+
+def flush_instrumentation():
+    """after_request / after_job: add this request's histograms to the current redis window"""
+    stats = getattr(frappe.local, "payment_tracking_instrumentation_stats", None)
+    if not stats:
+        return
+
+    key = get_window_key(int(time.time() // WINDOW_SECONDS) * WINDOW_SECONDS)
+    pipeline = frappe.cache.pipeline()
+    for field, value in stats.items():
+        pipeline.hincrbyfloat(key, field, value)
+    pipeline.expire(key, WINDOW_SECONDS * (WINDOWS_KEPT + 1))
+    pipeline.execute()
+
+    stats.clear()
+
+
+def get_rolling_stats():
+    """Sum the last WINDOWS_KEPT windows: {field: value}"""
+    current = int(time.time() // WINDOW_SECONDS) * WINDOW_SECONDS
+
+    pipeline = frappe.cache.pipeline()
+    for i in range(WINDOWS_KEPT):
+        pipeline.hgetall(get_window_key(current - i * WINDOW_SECONDS))
+
+    totals = {}
+    for window in pipeline.execute():
+        for field, value in (window or {}).items():
+            field = frappe.safe_decode(field)
+            totals[field] = totals.get(field, 0) + float(value)
+
+    return totals
+
+
+def get_prometheus_text():
+    """Rolling histograms of every instrumented function in Prometheus text exposition format"""
+    # {histogram: {function: {"buckets": {index: n}, "sum": s, "count": c}}}
+    series = {histogram: {} for histogram in HISTOGRAMS}
+    for field, value in get_rolling_stats().items():
+        name, histogram, part = field.rsplit("|", 2)
+        if histogram not in series:
+            continue
+
+        data = series[histogram].setdefault(name, {"buckets": {}, "sum": 0, "count": 0})
+        if part in ("sum", "count"):
+            data[part] = value
+        else:
+            data["buckets"][int(part)] = value
+
+    lines = []
+    window_minutes = WINDOW_SECONDS * WINDOWS_KEPT // 60
+    for histogram, (buckets, help_text) in HISTOGRAMS.items():
+        metric = f"payment_tracking_{histogram}"
+        lines.append(f"# HELP {metric} {help_text} (last {window_minutes} minutes)")
+        lines.append(f"# TYPE {metric} histogram")
+
+        for name, data in sorted(series[histogram].items()):
+            labels = f'function="{name}"'
+            cumulative = 0
+            for i, bound in enumerate([*buckets, "+Inf"]):
+                cumulative += data["buckets"].get(i, 0)
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {format_value(cumulative)}')
+            lines.append(f"{metric}_sum{{{labels}}} {format_value(data['sum'])}")
+            lines.append(f"{metric}_count{{{labels}}} {format_value(data['count'])}")
+
+    return "\n".join(lines) + "\n"
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(round(value, 6))
@@ -0,0 +1,56 @@
+"""
+Lightweight counters for payment_tracking
+
+Counters are accumulated in memory for the current request/job and flushed
+to a redis hash once at the end (after_request / after_job hooks), so a hot
+path only pays for a dict update.
+"""
+
+import frappe
+
+METRICS_KEY = "payment_tracking:metrics"
+
+
+def incr(name, value=1):
+    """Add value to a counter for the current request/job"""
+    counters = getattr(frappe.local, "payment_tracking_counters", None)
+    if counters is None:
+        counters = frappe.local.payment_tracking_counters = {}
+
+    counters[name] = counters.get(name, 0) + value
+
+
+def flush_metrics():
+    """after_request / after_job: add this request's counters to the shared totals"""
+    counters = getattr(frappe.local, "payment_tracking_counters", None)
+    if not counters:
+        return
+
+    frappe.local.payment_tracking_counters = {}
+
+    key = frappe.cache.make_key(METRICS_KEY)
+    pipeline = frappe.cache.pipeline()
+    for name, value in counters.items():
+        pipeline.hincrbyfloat(key, name, value)
+    pipeline.execute()
+
+
+def get_counters():
+    """Return the shared counter totals as {name: value}"""
+    # Raw pipeline: RedisWrapper.hgetall would unpickle the plain numbers
+    pipeline = frappe.cache.pipeline()
+    pipeline.hgetall(frappe.cache.make_key(METRICS_KEY))
+    values = pipeline.execute()[0] or {}
+
+    return {frappe.safe_decode(name): float(value) for name, value in values.items()}
+
+
+def reset_counters(names):
+    """Drop the shared totals of the given counters, leaving the others alone"""
+    names = list(names)
+    if not names:
+        return
+
+    pipeline = frappe.cache.pipeline()
+    pipeline.hdel(frappe.cache.make_key(METRICS_KEY), *names)
+    pipeline.execute()
@@ -0,0 +1,164 @@
+"""
+Materialized Order <-> Invoice link index
+
+`tabOrder Invoice Link` holds one row per (Order, Invoice) pair found in the
+invoice items (`sales_order` / `purchase_order`). It replaces scanning the
+much larger Sales/Purchase Invoice Item tables with SELECT DISTINCT on every
+lookup, in both directions.
+
+Rows mirror the item tables for drafts, submitted and cancelled invoices
+alike (with `invoice_docstatus` kept up to date) and are removed when the
+invoice is deleted. `backfill_order_invoice_links` rebuilds the index from the
+item tables in one statement per invoice doctype.
+"""
+
+import hashlib
+
+import frappe
+
+from payment_tracking.sc_payment.instrumentation import instrumented
+
+LINK_DOCTYPE = "Order Invoice Link"
+
+# Invoice doctype -> (Order doctype, Invoice Item table, Order link field on the item)
+INVOICE_ORDER_MAP = {
+    "Sales Invoice": ("Sales Order", "Sales Invoice Item", "sales_order"),
+    "Purchase Invoice": ("Purchase Order", "Purchase Invoice Item", "purchase_order"),
+}
+
+# Order doctype -> Invoice doctype
+ORDER_INVOICE_MAP = {order_doctype: invoice_doctype for invoice_doctype, (order_doctype, *_rest) in INVOICE_ORDER_MAP.items()}
+
+LINK_FIELDS = ["name", "order_doctype", "order_name", "invoice_doctype", "invoice_name", "invoice_docstatus"]
+
+
+def get_link_name(invoice_doctype, invoice_name, order_name):
+    """Deterministic row name, identical to the MD5(CONCAT_WS(...)) used by the backfill"""
+    return hashlib.md5(f"{invoice_doctype}:{invoice_name}:{order_name}".encode()).hexdigest()
+
+
+@instrumented
+def sync_invoice_links(doc, method=None):
+    """
+    Invoice on_update / on_submit / on_cancel: bring the invoice's link rows
+    in line with its items and docstatus.
+    """
+    if doc.doctype not in INVOICE_ORDER_MAP:
+        return
+
+    order_doctype, _item_table, order_field = INVOICE_ORDER_MAP[doc.doctype]
+    orders = {item.get(order_field) for item in doc.get("items") if item.get(order_field)}
+
+    existing = frappe.db.sql(f"""
+        SELECT order_name, invoice_docstatus
+        FROM `tab{LINK_DOCTYPE}`
+        WHERE invoice_doctype = %(invoice_doctype)s AND invoice_name = %(invoice_name)s
+    """, {"invoice_doctype": doc.doctype, "invoice_name": doc.name})
+
+    if {row[0] for row in existing} == orders and all(row[1] == doc.docstatus for row in existing):
+        return
+
+    remove_invoice_links(doc)
+
+    if not orders:
+        return
+
+    now = frappe.utils.now()
+    frappe.db.bulk_insert(
+        LINK_DOCTYPE,
+        [*LINK_FIELDS, "creation", "modified", "owner", "modified_by"],
+        [
+            (
+                get_link_name(doc.doctype, doc.name, order_name),
+                order_doctype,
+                order_name,
+                doc.doctype,
+                doc.name,
+                doc.docstatus,
+                now,
+                now,
+                "Administrator",
+                "Administrator",
+            )
+            for order_name in sorted(orders)
+        ],
+        ignore_duplicates=True,
+    )
+
+
+@instrumented
+def remove_invoice_links(doc, method=None):
+    """Invoice on_trash: drop the invoice's link rows"""
+    frappe.db.sql(f"""
+        DELETE FROM `tab{LINK_DOCTYPE}`
+        WHERE invoice_doctype = %(invoice_doctype)s AND invoice_name = %(invoice_name)s
+    """, {"invoice_doctype": doc.doctype, "invoice_name": doc.name})
+
+
+def get_orders_for_invoices(invoice_doctype, invoice_names):
+    """Return {invoice_name: [order_name, ...]} with one query"""
+    invoice_names = tuple(set(invoice_names))
+    if not invoice_names or invoice_doctype not in INVOICE_ORDER_MAP:
+        return {}
+
+    orders = {}
+    for invoice_name, order_name in frappe.db.sql(f"""
+        SELECT invoice_name, order_name
+        FROM `tab{LINK_DOCTYPE}`
+        WHERE invoice_doctype = %(invoice_doctype)s AND invoice_name IN %(invoice_names)s
+        ORDER BY invoice_name, order_name
+    """, {"invoice_doctype": invoice_doctype, "invoice_names": invoice_names}):
+        orders.setdefault(invoice_name, []).append(order_name)
+
+    return orders
+
+
+def get_invoices_for_orders(order_doctype, order_names):
+    """Return {order_name: [invoice_name, ...]} with one query"""
+    order_names = tuple(set(order_names))
+    if not order_names or order_doctype not in ORDER_INVOICE_MAP:
+        return {}
+
+    invoices = {}
+    for order_name, invoice_name in frappe.db.sql(f"""
+        SELECT order_name, invoice_name
+        FROM `tab{LINK_DOCTYPE}`
+        WHERE order_doctype = %(order_doctype)s AND order_name IN %(order_names)s
+        ORDER BY order_name, invoice_name
+    """, {"order_doctype": order_doctype, "order_names": order_names}):
+        invoices.setdefault(order_name, []).append(invoice_name)
+
+    return invoices
+
+
+def backfill_order_invoice_links():
+    """
+    Rebuild the whole index from the invoice item tables with one
+    INSERT ... SELECT DISTINCT per invoice doctype.
+
+    Returns {invoice_doctype: rows inserted}.
+    """
+    summary = {}
+
+    for invoice_doctype, (order_doctype, item_table, order_field) in INVOICE_ORDER_MAP.items():
+        frappe.db.sql(f"""
+            DELETE FROM `tab{LINK_DOCTYPE}` WHERE invoice_doctype = %(invoice_doctype)s
+        """, {"invoice_doctype": invoice_doctype})
+
+        frappe.db.sql(f"""
+            INSERT IGNORE INTO `tab{LINK_DOCTYPE}`
+                (name, order_doctype, order_name, invoice_doctype, invoice_name, invoice_docstatus,
+                creation, modified, owner, modified_by)
+            SELECT DISTINCT
+                MD5(CONCAT_WS(':', %(invoice_doctype)s, inv.name, item.`{order_field}`)),
+                %(order_doctype)s, item.`{order_field}`, %(invoice_doctype)s, inv.name, inv.docstatus,
+                NOW(), NOW(), 'Administrator', 'Administrator'
+            FROM `tab{item_table}` item
+            INNER JOIN `tab{invoice_doctype}` inv ON inv.name = item.parent
+            WHERE IFNULL(item.`{order_field}`, '') != ''
+        """, {"invoice_doctype": invoice_doctype, "order_doctype": order_doctype})
+        summary[invoice_doctype] = frappe.db.sql("SELECT ROW_COUNT()")[0][0]
+
+        frappe.db.commit()
+
+    return summary
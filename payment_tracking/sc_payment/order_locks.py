@@ -0,0 +1,158 @@
+"""
+Per-Order advisory locks
+
+Every path that changes an Order's payment bookkeeping - schedule row links,
+Payment Entry schedule updates, Payment Request totals and payment totals -
+takes a MariaDB user lock (GET_LOCK) named after the Order first. Unrelated
+Orders never contend; writers of the same Order queue on one lock instead of
+piling up InnoDB row and gap locks on the Order and its schedule.
+
+- locks are re-entrant within a transaction and released after its commit or
+  rollback (they are connection-scoped, so a dropped connection frees them too)
+- all locks of one call are tried in a single query; if any is busy, the new
+  ones are given back and taken one by one in (doctype, name) order, waiting
+  at most `payment_tracking_order_lock_timeout` seconds (default 10) each
+- a timeout raises frappe.QueryTimeoutError, which the deadlock retry of
+  background jobs and bulk APIs treats like any other lock conflict
+- site config `payment_tracking_order_locks: 0` turns the service off
+
+Counters (see payment_tracking.sc_payment.metrics): `order_locks_acquired`,
+`order_locks_contended`, `order_lock_wait_seconds` and `order_lock_timeouts`.
+"""
+
+import hashlib
+import time
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt
+
+from payment_tracking.sc_payment import metrics
+from payment_tracking.sc_payment.instrumentation import instrumented
+from payment_tracking.sc_payment.order_invoice_links import (
+    INVOICE_ORDER_MAP,
+    ORDER_INVOICE_MAP,
+    get_orders_for_invoices,
+)
+
+DEFAULT_LOCK_TIMEOUT = 10
+
+
+def is_enabled():
+    return cint(frappe.conf.get("payment_tracking_order_locks", 1))
+
+
+def get_lock_timeout():
+    return flt(frappe.conf.get("payment_tracking_order_lock_timeout")) or DEFAULT_LOCK_TIMEOUT
+
+
+def get_lock_name(doctype, name):
+    """User lock names are server-wide and at most 64 characters: hash the site's database with the Order"""
+    key = f"{frappe.conf.db_name}:{doctype}:{name}"
+    return f"payment_tracking:{hashlib.md5(key.encode()).hexdigest()}"
+
+
+def get_held_locks():
+    """{(doctype, name): lock name} held by the current transaction"""
+    held = getattr(frappe.local, "payment_tracking_order_locks", None)
+    if held is None:
+        held = frappe.local.payment_tracking_order_locks = {}
+    return held
+
+
+def lock_orders(documents):
+    """
+    Take the advisory locks of the Orders among documents, (doctype, name)
+    pairs; other doctypes are ignored. Locks already held are not taken again.
+    """
+    if not is_enabled():
+        return
+
+    held = get_held_locks()
+    pending = sorted({
+        (doctype, name)
+        for doctype, name in documents
+        if doctype in ORDER_INVOICE_MAP and name and (doctype, name) not in held
+    })
+    if not pending:
+        return
+
+    if not held:
+        frappe.db.after_commit.add(release_order_locks)
+        frappe.db.after_rollback.add(release_order_locks)
+
+    lock_names = [get_lock_name(doctype, name) for doctype, name in pending]
+
+    # Fast path: try every lock without waiting in one round trip
+    results = frappe.db.sql(
+        f"SELECT {', '.join(['GET_LOCK(%s, 0)'] * len(lock_names))}",
+        lock_names,
+    )[0]
+    if all(cint(result) == 1 for result in results):
+        held.update(zip(pending, lock_names, strict=True))
+        metrics.incr("order_locks_acquired", len(pending))
+        return
+
+    # Contended: give back what was just taken, then wait for each lock in order
+    taken = [lock_name for lock_name, result in zip(lock_names, results, strict=True) if cint(result) == 1]
+    release_locks(taken)
+    metrics.incr("order_locks_contended")
+
+    timeout = get_lock_timeout()
+    started = time.monotonic()
+    try:
+        for document, lock_name in zip(pending, lock_names, strict=True):
+            if cint(frappe.db.sql("SELECT GET_LOCK(%s, %s)", (lock_name, timeout))[0][0]) != 1:
+                metrics.incr("order_lock_timeouts")
+                frappe.throw(
+                    _("{0} {1} is being updated by another user, please try again").format(
+                        _(document[0]), document[1]
+                    ),
+                    frappe.QueryTimeoutError,
+                )
+
+            held[document] = lock_name
+            metrics.incr("order_locks_acquired")
+    finally:
+        metrics.incr("order_lock_wait_seconds", time.monotonic() - started)
+
+
+def lock_order(doctype, name):
+    lock_orders([(doctype, name)])
+
+
+@instrumented
+def lock_payment_entry_orders(doc, method=None):
+    """
+    Payment Entry before_submit / before_cancel: lock the referenced Orders and
+    the Orders of referenced Invoices up front, before ERPNext or this app
+    write to any of them in the same transaction.
+    """
+    documents = set()
+    invoices_by_doctype = {}
+    for ref in doc.get("references"):
+        if not ref.reference_name:
+            continue
+        documents.add((ref.reference_doctype, ref.reference_name))
+        if ref.reference_doctype in INVOICE_ORDER_MAP:
+            invoices_by_doctype.setdefault(ref.reference_doctype, set()).add(ref.reference_name)
+
+    for invoice_doctype, invoice_names in invoices_by_doctype.items():
+        order_doctype = INVOICE_ORDER_MAP[invoice_doctype][0]
+        for order_names in get_orders_for_invoices(invoice_doctype, invoice_names).values():
+            documents.update((order_doctype, order_name) for order_name in order_names)
+
+    lock_orders(documents)
+
+
+def release_order_locks():
+    """after_commit / after_rollback: release every lock of the finished transaction"""
+    held = get_held_locks()
+    lock_names = list(held.values())
+    held.clear()
+    release_locks(lock_names)
+
+
+def release_locks(lock_names):
+    if lock_names:
+        frappe.db.sql(f"SELECT {', '.join(['RELEASE_LOCK(%s)'] * len(lock_names))}", lock_names)
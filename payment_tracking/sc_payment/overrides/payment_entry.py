@@ -15,6 +15,9 @@ from frappe.utils.data import fmt_money
 
 from erpnext.accounts.doctype.payment_entry.payment_entry import PaymentEntry
 
+from payment_tracking.sc_payment.order_locks import lock_orders
+from payment_tracking.sc_payment.schedule_cache import get_schedule_rows, invalidate_schedule
+
 
 class CustomPaymentEntry(PaymentEntry):
 
@@ -47,8 +50,18 @@ class CustomPaymentEntry(PaymentEntry):
             reference_names.add(key)
 
     def update_payment_schedule(self, cancel=0):
+        """
+        Same as ERPNext, keyed by (payment_term, reference_name, reference_doctype, idx).
+
+        All schedule rows of all referenced documents come from the schedule
+        cache (one query, usually already run by before_submit) plus one locking
+        read of their outstanding amounts, conversion rates with one query per
+        referenced doctype and field precisions once, and all row deltas are applied with one UPDATE, so the
+        query count does not grow with the references.
+        """
         invoice_payment_amount_map = {}
         invoice_paid_amount_map = {}
+        reference_total_amounts = {}
 
         for ref in self.get("references"):
             if not ref.payment_term or not ref.reference_name:
@@ -60,33 +73,67 @@ class CustomPaymentEntry(PaymentEntry):
             invoice_payment_amount_map.setdefault(key, 0.0)
             invoice_payment_amount_map[key] += ref.allocated_amount
 
-            if not invoice_paid_amount_map.get(key):
-                payment_schedule = frappe.get_all(
-                    "Payment Schedule",
-                    filters={"parent": ref.reference_name},
-                    fields=[
-                        "idx",
-                        "paid_amount",
-                        "payment_amount",
-                        "payment_term",
-                        "discount",
-                        "outstanding",
-                        "discount_type",
-                    ],
+            reference_total_amounts.setdefault((ref.reference_doctype, ref.reference_name), ref.total_amount)
+
+        if not invoice_payment_amount_map:
+            return
+
+        # The advisory locks serialize writers of the same Orders from here on, but the
+        # cached schedule rows may have been read (by populate_payment_schedule_idx or
+        # earlier in the request) before they were held. Cached rows are only used for
+        # the row layout (idx, payment_term, discount); outstanding, which the
+        # over-allocation check and the deltas depend on, is re-read below with a
+        # locking read, which sees the latest committed value and also row-locks
+        # Invoice schedules that have no advisory lock.
+        lock_orders(reference_total_amounts)
+
+        schedule_by_parent = get_schedule_rows({name for _doctype, name in reference_total_amounts})
+        outstanding_by_row = lock_schedule_outstanding(schedule_by_parent)
+
+        # Bulk submit (see sc_payment/bulk_payment_entries.py): deltas are staged for the
+        # whole chunk, so outstanding must include what earlier entries already took
+        bulk = frappe.flags.payment_tracking_bulk_submit if not cancel else None
+        outstanding_column = PAYMENT_SCHEDULE_DELTA_COLUMNS.index("outstanding")
+
+        for (reference_doctype, reference_name), total_amount in reference_total_amounts.items():
+            for term in schedule_by_parent.get(reference_name, []):
+                invoice_key = (term.payment_term, reference_name, reference_doctype, term.idx)
+                invoice_paid_amount_map.setdefault(invoice_key, {})
+                invoice_paid_amount_map[invoice_key]["outstanding"] = flt(
+                    outstanding_by_row.get(term.name, term.outstanding)
+                ) + (
+                    bulk.get_pending_delta(term.name, outstanding_column) if bulk else 0
                 )
-                for term in payment_schedule:
-                    invoice_key = (term.payment_term, ref.reference_name, ref.reference_doctype, term.idx)
-                    invoice_paid_amount_map.setdefault(invoice_key, {})
-                    invoice_paid_amount_map[invoice_key]["outstanding"] = term.outstanding
-                    if not (term.discount_type and term.discount):
-                        continue
-
-                    if term.discount_type == "Percentage":
-                        invoice_paid_amount_map[invoice_key]["discounted_amt"] = ref.total_amount * (
-                            term.discount / 100
-                        )
-                    else:
-                        invoice_paid_amount_map[invoice_key]["discounted_amt"] = term.discount
+                if not (term.discount_type and term.discount):
+                    continue
+
+                if term.discount_type == "Percentage":
+                    invoice_paid_amount_map[invoice_key]["discounted_amt"] = total_amount * (
+                        term.discount / 100
+                    )
+                else:
+                    invoice_paid_amount_map[invoice_key]["discounted_amt"] = term.discount
+
+        # Currency and conversion rate of every referenced document, one query per doctype
+        reference_rates = {}
+        names_by_doctype = {}
+        for reference_doctype, reference_name in reference_total_amounts:
+            names_by_doctype.setdefault(reference_doctype, []).append(reference_name)
+        for reference_doctype, names in names_by_doctype.items():
+            for row in frappe.get_all(
+                reference_doctype,
+                filters={"name": ["in", names]},
+                fields=["name", "currency", "conversion_rate"],
+            ):
+                reference_rates[(reference_doctype, row.name)] = row
+
+        schedule_meta = frappe.get_meta("Payment Schedule")
+        base_paid_amount_precision = get_field_precision(schedule_meta.get_field("base_paid_amount"))
+        base_outstanding_precision = get_field_precision(schedule_meta.get_field("base_outstanding"))
+
+        # Schedule row name -> summed (paid_amount, base_paid_amount, discounted_amount,
+        # outstanding, base_outstanding) deltas, written by one UPDATE at the end
+        row_deltas = {}
 
         for idx, (key, allocated_amount) in enumerate(invoice_payment_amount_map.items(), 1):
             if not invoice_paid_amount_map.get(key):
@@ -106,20 +153,13 @@ class CustomPaymentEntry(PaymentEntry):
                     )
                     continue
 
-            allocated_amount = self.get_allocated_amount_in_transaction_currency(
-                allocated_amount, key[2], key[1]
-            )
+            reference = reference_rates.get((key[2], key[1])) or frappe._dict()
+            allocated_amount = self.convert_to_transaction_currency(allocated_amount, reference)
 
             outstanding = flt(invoice_paid_amount_map.get(key, {}).get("outstanding"))
             discounted_amt = flt(invoice_paid_amount_map.get(key, {}).get("discounted_amt"))
 
-            conversion_rate = frappe.db.get_value(key[2], {"name": key[1]}, "conversion_rate")
-            base_paid_amount_precision = get_field_precision(
-                frappe.get_meta("Payment Schedule").get_field("base_paid_amount")
-            )
-            base_outstanding_precision = get_field_precision(
-                frappe.get_meta("Payment Schedule").get_field("base_outstanding")
-            )
+            conversion_rate = reference.conversion_rate
 
             base_paid_amount = flt(
                 (allocated_amount - discounted_amt) * conversion_rate, base_paid_amount_precision
@@ -127,47 +167,22 @@ class CustomPaymentEntry(PaymentEntry):
             base_outstanding = flt(allocated_amount * conversion_rate, base_outstanding_precision)
 
             schedule_idx = key[3]
+            parent_rows = schedule_by_parent.get(key[1], [])
 
             if schedule_idx:
                 # Use idx to target the exact row
-                where_clause = "WHERE parent = %s and payment_term = %s and idx = %s"
-                where_params_cancel = (
-                    allocated_amount - discounted_amt,
-                    base_paid_amount,
-                    discounted_amt,
-                    allocated_amount,
-                    base_outstanding,
-                    key[1],
-                    key[0],
-                    schedule_idx,
-                )
-                where_params_submit = where_params_cancel
+                row_names = [t.name for t in parent_rows if t.payment_term == key[0] and t.idx == schedule_idx]
             else:
                 # Fallback to original behavior when idx is not available
-                where_clause = "WHERE parent = %s and payment_term = %s"
-                where_params_cancel = (
-                    allocated_amount - discounted_amt,
-                    base_paid_amount,
-                    discounted_amt,
-                    allocated_amount,
-                    base_outstanding,
-                    key[1],
-                    key[0],
-                )
-                where_params_submit = where_params_cancel
+                row_names = [t.name for t in parent_rows if t.payment_term == key[0]]
 
             if cancel:
-                frappe.db.sql(
-                    f"""
-                    UPDATE `tabPayment Schedule`
-                    SET
-                        paid_amount = `paid_amount` - %s,
-                        base_paid_amount = `base_paid_amount` - %s,
-                        discounted_amount = `discounted_amount` - %s,
-                        outstanding = `outstanding` + %s,
-                        base_outstanding = `base_outstanding` - %s
-                    {where_clause}""",
-                    where_params_cancel,
+                delta = (
+                    -(allocated_amount - discounted_amt),
+                    -base_paid_amount,
+                    -discounted_amt,
+                    allocated_amount,
+                    -base_outstanding,
                 )
             else:
                 if allocated_amount > outstanding:
@@ -177,16 +192,112 @@ class CustomPaymentEntry(PaymentEntry):
                         )
                     )
 
-                if allocated_amount and outstanding:
-                    frappe.db.sql(
-                        f"""
-                        UPDATE `tabPayment Schedule`
-                        SET
-                            paid_amount = `paid_amount` + %s,
-                            base_paid_amount = `base_paid_amount` + %s,
-                            discounted_amount = `discounted_amount` + %s,
-                            outstanding = `outstanding` - %s,
-                            base_outstanding = `base_outstanding` - %s
-                        {where_clause}""",
-                        where_params_submit,
-                    )
+                if not (allocated_amount and outstanding):
+                    continue
+
+                delta = (
+                    allocated_amount - discounted_amt,
+                    base_paid_amount,
+                    discounted_amt,
+                    -allocated_amount,
+                    -base_outstanding,
+                )
+
+            for row_name in row_names:
+                row_delta = row_deltas.setdefault(row_name, [0.0] * len(delta))
+                for i, value in enumerate(delta):
+                    row_delta[i] += value
+
+        if bulk:
+            bulk.stage_schedule_deltas(row_deltas)
+            return
+
+        apply_payment_schedule_deltas(row_deltas)
+        invalidate_schedule(schedule_by_parent)
+
+    def convert_to_transaction_currency(self, allocated_amount, reference):
+        """
+        get_allocated_amount_in_transaction_currency() without its per-call
+        lookup: reference carries the prefetched currency and conversion_rate.
+
+        Payment Entry could be in base currency while the reference's payment
+        schedule is always in transaction currency.
+        """
+        is_single_currency = self.paid_from_account_currency == self.paid_to_account_currency
+        reference_is_multi_currency = self.paid_from_account_currency != reference.currency
+
+        if not (is_single_currency and reference_is_multi_currency):
+            return allocated_amount
+
+        return flt(allocated_amount / reference.conversion_rate, self.precision("total_allocated_amount"))
+
+
+# Payment Schedule columns changed by a Payment Entry, in delta tuple order
+PAYMENT_SCHEDULE_DELTA_COLUMNS = (
+    "paid_amount",
+    "base_paid_amount",
+    "discounted_amount",
+    "outstanding",
+    "base_outstanding",
+)
+
+
+def lock_schedule_outstanding(parents):
+    """
+    Lock the Payment Schedule rows of parents in (parent, idx) order and
+    return {row name: current outstanding}
+    """
+    parents = list(parents)
+    if not parents:
+        return {}
+
+    return dict(frappe.db.sql(
+        f"""
+        SELECT name, outstanding FROM `tabPayment Schedule`
+        WHERE parent IN ({", ".join(["%s"] * len(parents))})
+        ORDER BY parent, idx
+        FOR UPDATE""",
+        parents,
+    ))
+
+
+def apply_payment_schedule_deltas(row_deltas):
+    """
+    Add {schedule row name: (paid_amount, base_paid_amount, discounted_amount,
+    outstanding, base_outstanding)} deltas to Payment Schedule rows with a single
+    CASE-keyed UPDATE, after locking the rows in (parent, idx) order.
+    The caller holds the advisory locks of the rows' Orders (update_payment_schedule
+    takes them, also when a bulk submit stages the deltas).
+    """
+    if not row_deltas:
+        return
+
+    # Lock the rows in one global order, (parent, idx), before writing, so
+    # concurrent entries touching overlapping schedules cannot deadlock
+    row_names = frappe.db.sql_list(
+        f"""
+        SELECT name FROM `tabPayment Schedule`
+        WHERE name IN ({", ".join(["%s"] * len(row_deltas))})
+        ORDER BY parent, idx
+        FOR UPDATE""",
+        list(row_deltas),
+    )
+    if not row_names:
+        return
+    assignments = []
+    values = []
+    for i, column in enumerate(PAYMENT_SCHEDULE_DELTA_COLUMNS):
+        cases = " ".join(["WHEN %s THEN %s"] * len(row_names))
+        assignments.append(f"`{column}` = `{column}` + CASE name {cases} ELSE 0 END")
+        for row_name in row_names:
+            values.extend((row_name, row_deltas[row_name][i]))
+
+    values.extend(row_names)
+
+    frappe.db.sql(
+        f"""
+        UPDATE `tabPayment Schedule`
+        SET {", ".join(assignments)}
+        WHERE name IN ({", ".join(["%s"] * len(row_names))})""",
+        values,
+    )
@@ -0,0 +1,105 @@
+"""
+Cached Customer / Supplier display names
+
+Names live in one redis hash per site ("<party_type>::<party>" -> name),
+read and filled for many parties with a single round trip each way.
+The hash expires PARTY_NAME_CACHE_TTL seconds after it was started and is
+dropped once it would grow beyond PARTY_NAME_CACHE_SIZE entries, so stale
+or unused names do not pile up. Customer / Supplier updates, renames and
+deletions remove their entry right away (see hooks.py).
+
+Values are plain strings, so the raw redis pipeline is used instead of the
+pickling RedisWrapper helpers.
+"""
+
+from functools import partial
+
+import frappe
+
+from payment_tracking.sc_payment.instrumentation import instrumented
+
+# Party doctype -> display name field
+PARTY_NAME_FIELDS = {
+    "Customer": "customer_name",
+    "Supplier": "supplier_name",
+}
+
+PARTY_NAME_CACHE_KEY = "payment_tracking:party_names"
+PARTY_NAME_CACHE_TTL = 6 * 60 * 60
+PARTY_NAME_CACHE_SIZE = 50000
+
+
+def get_party_names(parties):
+    """
+    Return {(party_type, party): display name} for many parties, falling back
+    to the party ID for unknown party types or missing parties.
+    """
+    parties = list(dict.fromkeys((party_type, party) for party_type, party in parties if party))
+    names = {(party_type, party): party for party_type, party in parties}
+
+    parties = [(party_type, party) for party_type, party in parties if party_type in PARTY_NAME_FIELDS]
+    if not parties:
+        return names
+
+    key = frappe.cache.make_key(PARTY_NAME_CACHE_KEY)
+    pipeline = frappe.cache.pipeline()
+    pipeline.hmget(key, [get_field(*party) for party in parties])
+    pipeline.hlen(key)
+    cached, size = pipeline.execute()
+
+    missing = {}
+    for party, value in zip(parties, cached, strict=True):
+        if value is None:
+            missing.setdefault(party[0], []).append(party[1])
+        else:
+            names[party] = frappe.safe_decode(value)
+
+    fetched = {}
+    for party_type, party_names in missing.items():
+        name_field = PARTY_NAME_FIELDS[party_type]
+        for row in frappe.get_all(party_type, filters={"name": ["in", party_names]}, fields=["name", name_field]):
+            fetched[(party_type, row.name)] = row.get(name_field) or row.name
+
+    if fetched:
+        names.update(fetched)
+
+        pipeline = frappe.cache.pipeline()
+        if size + len(fetched) > PARTY_NAME_CACHE_SIZE:
+            pipeline.delete(key)
+            size = 0
+        pipeline.hset(key, mapping={get_field(*party): name for party, name in fetched.items()})
+        if not size:
+            pipeline.expire(key, PARTY_NAME_CACHE_TTL)
+        pipeline.execute()
+
+    return names
+
+
+def get_party_name(party_type, party):
+    """Display name of a Customer / Supplier, falling back to its ID"""
+    if not party:
+        return party
+
+    return get_party_names([(party_type, party)])[(party_type, party)]
+
+
+@instrumented
+def invalidate_party_name(doc, method=None, old_name=None, new_name=None, merge=False):
+    """Customer / Supplier on_update, on_trash and after_rename: forget the cached name"""
+    fields = [get_field(doc.doctype, doc.name)]
+    if old_name:
+        fields.append(get_field(doc.doctype, old_name))
+
+    # Again after commit, in case a concurrent request cached the old name meanwhile
+    drop_party_names(fields)
+    frappe.db.after_commit.add(partial(drop_party_names, fields))
+
+
+def drop_party_names(fields):
+    pipeline = frappe.cache.pipeline()
+    pipeline.hdel(frappe.cache.make_key(PARTY_NAME_CACHE_KEY), *fields)
+    pipeline.execute()
+
+
+def get_field(party_type, party):
+    return f"{party_type}::{party}"
@@ -0,0 +1,216 @@
+"""
+Payment Request availability for Orders
+
+Answers "can a Payment Request of this amount be created?" from a few
+columns of the Order (rounded_total, grand_total, advance_paid and
+custom_payment_requested_amount), without loading the Order with its items
+and taxes. The batch variant does the same for every Payment Schedule row of
+many Orders at once.
+
+custom_payment_requested_amount is the running total of submitted Payment
+Requests, moved by delta on Payment Request submit/cancel. Rebuild it with
+`bench --site <site_name> rebuild-payment-requested-amounts`.
+"""
+
+import frappe
+from frappe import _
+from frappe.utils import flt
+
+from payment_tracking.sc_payment.instrumentation import instrumented
+from payment_tracking.sc_payment.order_locks import lock_order
+from payment_tracking.sc_payment.schedule_cache import get_schedule_rows
+
+PAYMENT_REQUEST_ORDER_DOCTYPES = ("Purchase Order", "Sales Order")
+
+ORDER_AMOUNT_FIELDS = [
+    "name",
+    "docstatus",
+    "rounded_total",
+    "grand_total",
+    "advance_paid",
+    "custom_payment_requested_amount",
+]
+
+
+def get_payment_requested_amounts(order_doctype, order_names):
+    """Return {order_name: total of submitted Payment Requests} from the stored running totals"""
+    order_names = list(set(order_names))
+    if not order_names:
+        return {}
+
+    return {
+        row.name: flt(row.custom_payment_requested_amount)
+        for row in frappe.get_all(
+            order_doctype,
+            filters={"name": ["in", order_names]},
+            fields=["name", "custom_payment_requested_amount"],
+        )
+    }
+
+
+@instrumented
+def update_payment_requested_amount(doc, method=None):
+    """
+    Payment Request on_submit / on_cancel: add or subtract its grand_total
+    to the Order's running total with one atomic UPDATE.
+    """
+    if doc.reference_doctype not in PAYMENT_REQUEST_ORDER_DOCTYPES or not doc.reference_name:
+        return
+
+    sign = -1 if method == "on_cancel" else 1
+    lock_order(doc.reference_doctype, doc.reference_name)
+
+    frappe.db.sql(f"""
+        UPDATE `tab{doc.reference_doctype}`
+        SET custom_payment_requested_amount = IFNULL(custom_payment_requested_amount, 0) + %(amount)s
+        WHERE name = %(name)s
+    """, {"amount": sign * flt(doc.grand_total), "name": doc.reference_name})
+
+
+def rebuild_payment_requested_amounts(doctypes=None):
+    """
+    Recompute custom_payment_requested_amount from submitted Payment Requests
+    with one set-based UPDATE per Order doctype.
+
+    Returns {doctype: rows changed}.
+    """
+    summary = {}
+
+    for doctype in doctypes or PAYMENT_REQUEST_ORDER_DOCTYPES:
+        if doctype not in PAYMENT_REQUEST_ORDER_DOCTYPES:
+            frappe.throw(_("Payment Request totals are not tracked for {0}").format(doctype))
+
+        frappe.db.sql(f"""
+            UPDATE `tab{doctype}` doc
+            LEFT JOIN (
+                SELECT reference_name, SUM(grand_total) AS total
+                FROM `tabPayment Request`
+                WHERE reference_doctype = %(doctype)s AND docstatus = 1
+                GROUP BY reference_name
+            ) requests ON requests.reference_name = doc.name
+            SET doc.custom_payment_requested_amount = IFNULL(requests.total, 0)
+        """, {"doctype": doctype})
+        summary[doctype] = frappe.db.sql("SELECT ROW_COUNT()")[0][0]
+        frappe.db.commit()
+
+    return summary
+
+
+def get_remaining_amounts(order_doctype, order_names):
+    """
+    Return {order_name: frappe._dict(docstatus, available, requested, remaining)}
+    where available = (rounded_total or grand_total) - advance_paid and
+    remaining = available - submitted Payment Requests.
+    """
+    amounts = {}
+    for order in frappe.get_all(
+        order_doctype, filters={"name": ["in", list(set(order_names))]}, fields=ORDER_AMOUNT_FIELDS
+    ):
+        available = flt(order.rounded_total or order.grand_total) - flt(order.advance_paid)
+        requested = flt(order.custom_payment_requested_amount)
+        amounts[order.name] = frappe._dict(
+            docstatus=order.docstatus,
+            available=available,
+            requested=requested,
+            remaining=available - requested,
+        )
+
+    return amounts
+
+
+def check_payment_request_amount(amounts, payment_amount):
+    """
+    ERPNext rule for one Payment Request against one Order's amounts.
+    Returns {can_create: bool, error_message: str}.
+    """
+    payment_amount = flt(payment_amount)
+
+    # If already fully paid
+    if amounts.available <= 0:
+        return {"can_create": False, "error_message": _("Payment Entry is already created")}
+
+    if amounts.remaining <= 0:
+        return {"can_create": False, "error_message": _("Payment Request is already created")}
+
+    # Check if new PR amount would exceed available
+    if payment_amount > amounts.remaining:
+        return {
+            "can_create": False,
+            "error_message": _("Payment Request amount ({0}) exceeds available amount ({1})").format(
+                frappe.format_value(payment_amount, {"fieldtype": "Currency"}),
+                frappe.format_value(amounts.remaining, {"fieldtype": "Currency"})
+            )
+        }
+
+    return {"can_create": True}
+
+
+def can_create_payment_request(order_doctype, order_name, payment_amount):
+    """Validate one Payment Request amount against an Order"""
+    amounts = get_remaining_amounts(order_doctype, [order_name]).get(order_name)
+    if not amounts:
+        frappe.throw(_("{0} {1} not found").format(_(order_doctype), order_name), frappe.DoesNotExistError)
+
+    return check_payment_request_amount(amounts, payment_amount)
+
+
+def get_schedule_availability(order_doctype, order_names):
+    """
+    Availability of every Payment Schedule row of the given Orders, with one
+    query for the Orders and one for the schedules.
+
+    Returns {order_name: [{name, idx, payment_term, payment_amount, due_date,
+    custom_invoice_doctype, custom_invoice_name, action, can_create,
+    error_message}]} where action is "Payment Request" for advance rows and
+    the Order's invoice doctype for the last row. Advance rows are checked
+    against the Order's remaining amount one by one, not cumulatively, like
+    the "+" button does.
+    """
+    if order_doctype not in PAYMENT_REQUEST_ORDER_DOCTYPES:
+        frappe.throw(_("Payment Requests from schedule are not supported for {0}").format(order_doctype))
+
+    invoice_doctype = "Purchase Invoice" if order_doctype == "Purchase Order" else "Sales Invoice"
+    amounts_by_order = get_remaining_amounts(order_doctype, order_names)
+    schedules = get_schedule_rows(amounts_by_order)
+
+    availability = {}
+    for order_name, amounts in amounts_by_order.items():
+        rows = schedules.get(order_name, [])
+        availability[order_name] = []
+
+        for position, row in enumerate(rows, 1):
+            is_last_row = position == len(rows)
+            result = {
+                "name": row.name,
+                "idx": row.idx,
+                "payment_term": row.payment_term,
+                "payment_amount": row.payment_amount,
+                "due_date": row.due_date,
+                "custom_invoice_doctype": row.custom_invoice_doctype,
+                "custom_invoice_name": row.custom_invoice_name,
+                "action": invoice_doctype if is_last_row else "Payment Request",
+            }
+
+            if amounts.docstatus == 2:
+                result.update(can_create=False, error_message=_("You can't create invoice against cancelled document"))
+            elif row.custom_invoice_name:
+                result.update(
+                    can_create=False,
+                    error_message=_("Invoice for this advance payment already exists: {0}").format(row.custom_invoice_name),
+                )
+            elif is_last_row:
+                if amounts.docstatus == 1:
+                    result.update(can_create=True)
+                else:
+                    result.update(
+                        can_create=False,
+                        error_message=_("{0} must be submitted before creating {1}").format(
+                            _(order_doctype), _(invoice_doctype)
+                        ),
+                    )
+            else:
+                result.update(check_payment_request_amount(amounts, row.payment_amount))
+
+            availability[order_name].append(result)
+
+    return availability
@@ -0,0 +1,356 @@
+"""
+Payment totals engine
+
+Maintains `custom_total_payment` on Purchase/Sales Orders and Invoices from
+submitted Payment Entries.
+
+Modes (site config `payment_tracking_total_payment_mode`):
+- "recompute" (default): recompute affected documents from all their payments,
+  one grouped query and one multi-row UPDATE per doctype
+- "incremental": apply only the signed allocated amounts of the current
+  Payment Entry with an atomic `custom_total_payment = custom_total_payment + x`
+- "deferred": record affected documents during the transaction and recompute
+  them in background jobs after commit, one deduplicated job per document
+
+Incremental mode assumes stored totals are consistent, so run
+`recalculate_all_payments` once after switching to it. Set
+`payment_tracking_verify_totals` to recompute every updated document after the
+delta is applied; mismatches are logged and corrected.
+"""
+
+import frappe
+from frappe.utils import flt
+
+from payment_tracking.sc_payment.deadlocks import retry_on_deadlock
+from payment_tracking.sc_payment.order_invoice_links import (
+    INVOICE_ORDER_MAP,
+    LINK_DOCTYPE,
+    ORDER_INVOICE_MAP,
+    get_orders_for_invoices,
+)
+from payment_tracking.sc_payment.order_locks import lock_orders
+
+TOTAL_PAYMENT_DOCTYPES = ("Purchase Order", "Sales Order", "Purchase Invoice", "Sales Invoice")
+
+# Payment types that count towards the totals
+COUNTED_PAYMENT_TYPES = ("Receive", "Pay")
+
+# Maximum number of documents per grouped SELECT / multi-row UPDATE statement
+BATCH_SIZE = 500
+
+# Deferred mode: how long a document's dirty marker lives and how many times a
+# job re-runs when new payments keep arriving while it is recomputing
+DIRTY_MARKER_TTL = 24 * 60 * 60
+MAX_DEFERRED_PASSES = 5
+
+# Deletes the dirty marker only if no new payment bumped it meanwhile
+_RELEASE_DIRTY_MARKER = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def get_total_payment_mode():
+    """Return the configured totals maintenance mode"""
+    return frappe.conf.get("payment_tracking_total_payment_mode") or "recompute"
+
+
+def get_payments_query(doctype, params, names_condition=None):
+    """
+    Build the query listing every counted payment row for documents of a doctype
+    as (reference_row, docname, allocated_amount). Adds its values to params.
+
+    Direct payments, plus payments to linked Invoices for Orders (resolved
+    through the Order Invoice Link index, one row per Order/Invoice pair).
+    names_condition (e.g. "IN %(names)s") restricts docname; None means all.
+    """
+    params.update({"doctype": doctype, "payment_types": COUNTED_PAYMENT_TYPES})
+
+    direct_condition = f"AND per.reference_name {names_condition}" if names_condition else ""
+    subqueries = [f"""
+        SELECT per.name AS reference_row, per.reference_name AS docname, per.allocated_amount
+        FROM `tabPayment Entry Reference` per
+        INNER JOIN `tabPayment Entry` pe ON pe.name = per.parent
+        WHERE
+            per.reference_doctype = %(doctype)s
+            {direct_condition}
+            AND pe.docstatus = 1
+            AND pe.payment_type IN %(payment_types)s
+    """]
+
+    if doctype in ORDER_INVOICE_MAP:
+        params["invoice_doctype"] = ORDER_INVOICE_MAP[doctype]
+        order_condition = f"AND link.order_name {names_condition}" if names_condition else ""
+        subqueries.append(f"""
+            SELECT per.name, link.order_name, per.allocated_amount
+            FROM `tabPayment Entry Reference` per
+            INNER JOIN `tabPayment Entry` pe ON pe.name = per.parent
+            INNER JOIN `tab{LINK_DOCTYPE}` link
+                ON link.invoice_doctype = per.reference_doctype AND link.invoice_name = per.reference_name
+            WHERE
+                per.reference_doctype = %(invoice_doctype)s
+                {order_condition}
+                AND pe.docstatus = 1
+                AND pe.payment_type IN %(payment_types)s
+        """)
+
+    return " UNION ALL ".join(f"({subquery})" for subquery in subqueries)
+
+
+def get_documents_total_payment(doctype, docnames):
+    """
+    Calculate total payment for many documents of one doctype from all
+    submitted Payment Entries, with one grouped query per BATCH_SIZE documents.
+
+    Returns {name: total}; documents without payments map to 0.
+    """
+    docnames = list(dict.fromkeys(docnames))
+    totals = dict.fromkeys(docnames, 0)
+
+    for start in range(0, len(docnames), BATCH_SIZE):
+        names = tuple(docnames[start:start + BATCH_SIZE])
+        params = {"names": names}
+        payments_query = get_payments_query(doctype, params, "IN %(names)s")
+
+        rows = frappe.db.sql(f"""
+            SELECT payments.docname, SUM(payments.allocated_amount)
+            FROM ({payments_query}) payments
+            GROUP BY payments.docname
+        """, params)
+
+        for docname, total in rows:
+            totals[docname] = flt(total)
+
+    return totals
+
+
+def write_documents_total_payment(doctype, totals):
+    """Write {name: total} back with one multi-row UPDATE per BATCH_SIZE documents"""
+    if not totals:
+        return
+
+    # Check if the custom field exists
+    if not frappe.db.has_column(doctype, "custom_total_payment"):
+        frappe.throw(f"Custom field 'custom_total_payment' not found in {doctype}. Please reinstall the app.")
+
+    # Sorted by name, so concurrent writers lock documents in the same order
+    items = sorted(totals.items())
+    for start in range(0, len(items), BATCH_SIZE):
+        chunk = items[start:start + BATCH_SIZE]
+
+        frappe.db.sql(f"""
+            SELECT name FROM `tab{doctype}`
+            WHERE name IN ({", ".join(["%s"] * len(chunk))})
+            ORDER BY name
+            FOR UPDATE
+        """, [docname for docname, _total in chunk])
+        cases = " ".join(["WHEN %s THEN %s"] * len(chunk))
+        placeholders = ", ".join(["%s"] * len(chunk))
+
+        values = [value for docname, total in chunk for value in (docname, total)]
+        values.extend(docname for docname, _total in chunk)
+
+        frappe.db.sql(f"""
+            UPDATE `tab{doctype}`
+            SET custom_total_payment = CASE name {cases} ELSE custom_total_payment END
+            WHERE name IN ({placeholders})
+        """, values)
+
+
+def update_documents_total_payment(documents):
+    """
+    Recompute and store totals for a set of (doctype, name) pairs.
+
+    Runs inside the caller's transaction; nothing is committed here.
+    Returns {(doctype, name): total}.
+    """
+    names_by_doctype = {}
+    for doctype, docname in documents:
+        if doctype in TOTAL_PAYMENT_DOCTYPES and docname:
+            names_by_doctype.setdefault(doctype, []).append(docname)
+
+    lock_orders(
+        (doctype, docname) for doctype, docnames in names_by_doctype.items() for docname in docnames
+    )
+
+    # Doctypes and names are written in sorted order (the global lock order)
+    result = {}
+    for doctype, docnames in sorted(names_by_doctype.items()):
+        totals = get_documents_total_payment(doctype, docnames)
+        write_documents_total_payment(doctype, totals)
+        result.update({(doctype, docname): total for docname, total in totals.items()})
+
+    return result
+
+
+def get_payment_entry_deltas(doc):
+    """
+    Return {(doctype, name): amount} contributed by a Payment Entry.
+
+    Every reference row adds its allocated amount to the referenced document
+    and, for Invoices, to each Order linked to the invoice.
+    """
+    deltas = {}
+
+    if doc.payment_type not in COUNTED_PAYMENT_TYPES:
+        return deltas
+
+    invoice_amounts = {}
+    for ref in doc.get("references"):
+        if ref.reference_doctype not in TOTAL_PAYMENT_DOCTYPES or not ref.reference_name:
+            continue
+
+        amount = flt(ref.allocated_amount)
+        if not amount:
+            continue
+
+        key = (ref.reference_doctype, ref.reference_name)
+        deltas[key] = deltas.get(key, 0) + amount
+
+        if ref.reference_doctype in INVOICE_ORDER_MAP:
+            invoice_amounts[key] = invoice_amounts.get(key, 0) + amount
+
+    # Orders linked to referenced Invoices receive the same amounts
+    for invoice_doctype, (order_doctype, *_rest) in INVOICE_ORDER_MAP.items():
+        invoice_names = [name for doctype, name in invoice_amounts if doctype == invoice_doctype]
+        for invoice_name, order_names in get_orders_for_invoices(invoice_doctype, invoice_names).items():
+            for order_name in order_names:
+                key = (order_doctype, order_name)
+                deltas[key] = deltas.get(key, 0) + invoice_amounts[(invoice_doctype, invoice_name)]
+
+    return deltas
+
+
+def apply_payment_entry_delta(doc, sign):
+    """
+    Add (sign=1) or subtract (sign=-1) a Payment Entry's allocated amounts
+    to the stored totals of every affected document.
+
+    Runs inside the caller's transaction; nothing is committed here.
+    """
+    deltas = get_payment_entry_deltas(doc)
+    lock_orders(deltas)
+
+    # (doctype, name) order, the same order every writer locks documents in
+    for (doctype, docname), amount in sorted(deltas.items()):
+        frappe.db.sql(f"""
+            UPDATE `tab{doctype}`
+            SET custom_total_payment = IFNULL(custom_total_payment, 0) + %(amount)s
+            WHERE name = %(docname)s
+        """, {"amount": sign * amount, "docname": docname})
+
+    if frappe.conf.get("payment_tracking_verify_totals"):
+        verify_document_totals(deltas)
+
+    return deltas
+
+
+def verify_document_totals(documents):
+    """Recompute stored totals for documents and correct any that drifted"""
+    names_by_doctype = {}
+    for doctype, docname in documents:
+        names_by_doctype.setdefault(doctype, []).append(docname)
+
+    for doctype, docnames in names_by_doctype.items():
+        expected_totals = get_documents_total_payment(doctype, docnames)
+        stored_totals = dict(frappe.get_all(
+            doctype,
+            filters={"name": ["in", docnames]},
+            fields=["name", "custom_total_payment"],
+            as_list=True
+        ))
+
+        drifted = {}
+        for docname, expected in expected_totals.items():
+            stored = flt(stored_totals.get(docname))
+            if abs(stored - expected) >= 0.005:
+                drifted[docname] = expected
+                frappe.log_error(
+                    f"Incremental total for {doctype} {docname} was {stored}, expected {expected}",
+                    "Payment Tracking Total Mismatch"
+                )
+
+        write_documents_total_payment(doctype, drifted)
+
+
+def defer_documents_total_payment(documents):
+    """
+    Record documents whose totals must be recomputed once the current
+    transaction commits. Nothing is queued if the transaction rolls back.
+
+    Tests (frappe.flags.in_test) recompute synchronously instead.
+    """
+    documents = {(doctype, docname) for doctype, docname in documents if docname}
+
+    if frappe.flags.in_test:
+        update_documents_total_payment(documents)
+        return
+
+    if frappe.flags.payment_tracking_pending_totals is None:
+        frappe.flags.payment_tracking_pending_totals = set()
+        frappe.db.after_commit.add(enqueue_pending_totals)
+        frappe.db.after_rollback.add(discard_pending_totals)
+
+    frappe.flags.payment_tracking_pending_totals.update(documents)
+
+
+def discard_pending_totals():
+    """Drop documents recorded by a rolled back transaction"""
+    frappe.flags.payment_tracking_pending_totals = None
+
+
+def enqueue_pending_totals():
+    """After commit: enqueue one recompute job per recorded document"""
+    pending = frappe.flags.payment_tracking_pending_totals or set()
+    frappe.flags.payment_tracking_pending_totals = None
+
+    for doctype, docname in sorted(pending):
+        # Bump the marker first so an already running job for this document
+        # notices the new payment and recomputes again
+        marker = get_dirty_marker_key(doctype, docname)
+        frappe.cache.incr(marker)
+        frappe.cache.expire(marker, DIRTY_MARKER_TTL)
+
+        frappe.enqueue(
+            "payment_tracking.sc_payment.payment_totals.recompute_deferred_total",
+            queue="short",
+            job_id=f"payment_tracking::total_payment::{doctype}::{docname}",
+            deduplicate=True,
+            doctype=doctype,
+            docname=docname,
+        )
+
+
+def recompute_deferred_total(doctype, docname):
+    """
+    Background job: recompute one document's total.
+
+    Bursts of Payment Entries against the same document collapse into this
+    single job, since enqueueing is deduplicated while it is queued or running.
+    Passes repeat until no new payment arrived during the last one.
+    """
+    marker = get_dirty_marker_key(doctype, docname)
+
+    for _pass in range(MAX_DEFERRED_PASSES):
+        version = frappe.cache.get(marker)
+
+        retry_on_deadlock("deferred_total", commit_documents_total_payment, [(doctype, docname)])
+
+        if version is None or frappe.cache.eval(_RELEASE_DIRTY_MARKER, 1, marker, version):
+            return
+
+    frappe.log_error(
+        f"Total payment for {doctype} {docname} still changing after {MAX_DEFERRED_PASSES} passes",
+        "Payment Tracking Deferred Total"
+    )
+
+
+def commit_documents_total_payment(documents):
+    update_documents_total_payment(documents)
+    frappe.db.commit()
+
+
+def get_dirty_marker_key(doctype, docname):
+    return frappe.cache.make_key(f"payment_tracking:dirty_total:{doctype}:{docname}")
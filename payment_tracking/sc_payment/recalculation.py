@@ -0,0 +1,336 @@
+"""
+Full recalculation of payment totals
+
+Recalculates `custom_total_payment` for every Order and Invoice in background
+jobs on the long queue:
+
+- each doctype is split into RECALC_LANES name ranges, one job per range, so
+  several workers run in parallel
+- each job walks its range in keyset-paginated chunks (`name > cursor ORDER BY
+  name LIMIT n`) and recomputes a chunk with the batch engine
+- the cursor is committed together with the chunk's totals, so a killed run
+  resumes exactly where it stopped
+- progress (docs, docs/sec, ETA) is published as the
+  `payment_tracking_recalc_progress` realtime event
+
+For disaster recovery there is also a pure-SQL engine (engine="sql",
+`bench --site <site> rebuild-payment-totals`) that rebuilds each doctype with
+a single `UPDATE ... LEFT JOIN (SELECT ... GROUP BY ...)` statement.
+"""
+
+import json
+
+import frappe
+from frappe import _
+from frappe.utils import cint, now_datetime, time_diff_in_seconds
+from frappe.utils.background_jobs import is_job_enqueued
+
+from payment_tracking.sc_payment.deadlocks import is_lock_conflict, retry_on_deadlock
+from payment_tracking.sc_payment.payment_totals import (
+    TOTAL_PAYMENT_DOCTYPES,
+    get_payments_query,
+    update_documents_total_payment,
+)
+
+RECALC_CHUNK_SIZE = 1000
+RECALC_LANES = 4
+RECALC_ENGINES = ("jobs", "sql")
+
+RECALC_PLAN_KEY = "payment_tracking_recalc_plan"
+RECALC_PLAN_JOB_ID = "payment_tracking::recalc::plan"
+RECALC_PROGRESS_EVENT = "payment_tracking_recalc_progress"
+REBUILD_DONE_EVENT = "payment_tracking_rebuild_done"
+
+
+def start_recalculation(restart=False, engine="jobs", doctype=None):
+    """
+    Queue the recalculation. An unfinished previous run is resumed from its
+    checkpoints unless restart is set; a restart is refused while jobs of the
+    previous run are still queued or running, since they would keep
+    checkpointing over the new plan.
+
+    engine="sql" queues the set-based rebuild instead, optionally restricted
+    to one doctype. Arguments are validated before anything is queued.
+    """
+    if engine not in RECALC_ENGINES:
+        frappe.throw(_("Unknown recalculation engine {0}").format(engine))
+
+    if doctype and doctype not in TOTAL_PAYMENT_DOCTYPES:
+        frappe.throw(_("Payment totals are not tracked for {0}").format(doctype))
+
+    if doctype and engine != "sql":
+        frappe.throw(_("A single doctype can only be rebuilt with the sql engine"))
+
+    if engine == "sql":
+        frappe.enqueue(
+            "payment_tracking.sc_payment.recalculation.rebuild_totals_sql",
+            queue="long",
+            timeout=6 * 60 * 60,
+            job_id="payment_tracking::recalc::sql",
+            deduplicate=True,
+            doctypes=[doctype] if doctype else None,
+            notify_user=frappe.session.user,
+        )
+        return _("Payment totals rebuild queued in background")
+
+    plan = get_recalculation_plan()
+
+    if plan and not plan.get("finished") and not restart:
+        plan["resumed_at"] = str(now_datetime())
+        plan["done_at_resume"] = get_recalculation_progress(plan)["done"]
+        plan["user"] = frappe.session.user
+        frappe.db.set_global(RECALC_PLAN_KEY, json.dumps(plan))
+        frappe.db.commit()
+
+        enqueue_lanes(plan)
+        return _("Payment totals recalculation resumed in background")
+
+    if restart:
+        validate_no_active_recalculation(plan)
+
+    frappe.enqueue(
+        "payment_tracking.sc_payment.recalculation.plan_recalculation",
+        queue="long",
+        job_id=RECALC_PLAN_JOB_ID,
+        deduplicate=True,
+        user=frappe.session.user,
+    )
+    return _("Payment totals recalculation queued in background")
+
+
+def plan_recalculation(user=None):
+    """Background job: split every doctype into name ranges and queue one job per range"""
+    # Lanes of a previous run may have been resumed since the restart was accepted
+    validate_no_active_recalculation(get_recalculation_plan(), check_plan_job=False)
+
+    plan = {
+        "started_at": str(now_datetime()),
+        "resumed_at": str(now_datetime()),
+        "done_at_resume": 0,
+        "user": user,
+        "finished": 0,
+        "doctypes": {},
+    }
+
+    for doctype in TOTAL_PAYMENT_DOCTYPES:
+        total = frappe.db.count(doctype)
+        lanes = max(1, min(RECALC_LANES, total // RECALC_CHUNK_SIZE))
+
+        # Lane k covers (bounds[k], bounds[k + 1]]; the last lane is open-ended
+        bounds = [""]
+        for lane in range(1, lanes):
+            bounds.append(frappe.db.sql_list(f"""
+                SELECT name FROM `tab{doctype}`
+                ORDER BY name
+                LIMIT 1 OFFSET {total * lane // lanes - 1}
+            """)[0])
+        bounds.append(None)
+
+        plan["doctypes"][doctype] = {"total": total, "lanes": lanes}
+        for lane in range(lanes):
+            set_lane_state(doctype, lane, {
+                "lower": bounds[lane],
+                "upper": bounds[lane + 1],
+                "cursor": bounds[lane],
+                "done": 0,
+                "finished": 0,
+            })
+
+    frappe.db.set_global(RECALC_PLAN_KEY, json.dumps(plan))
+    frappe.db.commit()
+
+    enqueue_lanes(plan)
+
+
+def validate_no_active_recalculation(plan, check_plan_job=True):
+    """Throw if the planning job or a lane job of plan is queued or running"""
+    job_ids = [
+        get_lane_job_id(doctype, lane)
+        for doctype, info in (plan or {}).get("doctypes", {}).items()
+        for lane in range(info["lanes"])
+    ]
+    if check_plan_job:
+        job_ids.append(RECALC_PLAN_JOB_ID)
+
+    if any(is_job_enqueued(job_id) for job_id in job_ids):
+        frappe.throw(_("Payment totals recalculation is still running, wait for it to finish before restarting"))
+
+
+def get_lane_job_id(doctype, lane):
+    return f"payment_tracking::recalc::{doctype}::{lane}"
+
+
+def enqueue_lanes(plan):
+    for doctype, info in plan["doctypes"].items():
+        for lane in range(info["lanes"]):
+            if get_lane_state(doctype, lane).get("finished"):
+                continue
+
+            frappe.enqueue(
+                "payment_tracking.sc_payment.recalculation.recalculate_lane",
+                queue="long",
+                timeout=6 * 60 * 60,
+                job_id=get_lane_job_id(doctype, lane),
+                deduplicate=True,
+                doctype=doctype,
+                lane=lane,
+            )
+
+
+def recalculate_lane(doctype, lane):
+    """Background job: recompute one name range chunk by chunk, checkpointing after each chunk"""
+    state = get_lane_state(doctype, lane)
+
+    while not state.get("finished"):
+        state = retry_on_deadlock("recalc_lane", recalculate_lane_step, doctype, lane)
+        publish_recalculation_progress()
+
+
+def recalculate_lane_step(doctype, lane):
+    """Recompute the next chunk of a lane and commit it with its checkpoint; returns the new state"""
+    state = get_lane_state(doctype, lane)
+
+    upper_condition = "AND name <= %(upper)s" if state["upper"] is not None else ""
+    names = frappe.db.sql_list(f"""
+        SELECT name FROM `tab{doctype}`
+        WHERE name > %(cursor)s {upper_condition}
+        ORDER BY name
+        LIMIT {RECALC_CHUNK_SIZE}
+    """, {"cursor": state["cursor"], "upper": state["upper"]})
+
+    if names:
+        recalculate_chunk(doctype, names)
+        state["cursor"] = names[-1]
+        state["done"] += len(names)
+
+    if len(names) < RECALC_CHUNK_SIZE:
+        state["finished"] = 1
+
+    # Totals and checkpoint commit together
+    set_lane_state(doctype, lane, state)
+    frappe.db.commit()
+
+    return state
+
+
+def recalculate_chunk(doctype, names):
+    """
+    Recompute a chunk in one batch, falling back to one document at a time on error.
+    Deadlocks are raised: they abort the whole transaction, which the caller retries.
+    """
+    try:
+        update_documents_total_payment((doctype, name) for name in names)
+        return
+    except Exception as e:
+        if is_lock_conflict(e):
+            raise
+        frappe.db.rollback()
+
+    for name in names:
+        frappe.db.savepoint("payment_tracking_recalc_doc")
+        try:
+            update_documents_total_payment([(doctype, name)])
+        except Exception as e:
+            if is_lock_conflict(e):
+                raise
+            frappe.db.rollback(save_point="payment_tracking_recalc_doc")
+            frappe.log_error(
+                f"Error recalculating {doctype} {name}: {e!s}",
+                "Payment Tracking Recalculation Error"
+            )
+
+
+def publish_recalculation_progress():
+    plan = get_recalculation_plan()
+    if not plan:
+        return
+
+    progress = get_recalculation_progress(plan)
+
+    if progress["finished"] and not plan.get("finished"):
+        plan["finished"] = 1
+        frappe.db.set_global(RECALC_PLAN_KEY, json.dumps(plan))
+        frappe.db.commit()
+
+    frappe.publish_realtime(RECALC_PROGRESS_EVENT, progress, user=plan.get("user"))
+
+
+def get_recalculation_progress(plan):
+    """Return done/total counts with docs/sec and ETA since the run was (re)started"""
+    total = done = 0
+    finished = True
+    for doctype, info in plan["doctypes"].items():
+        total += info["total"]
+        for lane in range(info["lanes"]):
+            state = get_lane_state(doctype, lane)
+            done += state.get("done", 0)
+            finished = finished and bool(state.get("finished"))
+
+    elapsed = time_diff_in_seconds(now_datetime(), plan["resumed_at"])
+    rate = (done - cint(plan.get("done_at_resume"))) / elapsed if elapsed > 0 else 0
+    remaining = max(total - done, 0)
+
+    return {
+        "finished": finished,
+        "done": done,
+        "total": total,
+        "docs_per_sec": round(rate, 1),
+        "eta_seconds": round(remaining / rate) if rate else None,
+    }
+
+
+def get_recalculation_plan():
+    plan = frappe.db.get_global(RECALC_PLAN_KEY)
+    return json.loads(plan) if plan else None
+
+
+def get_lane_state(doctype, lane):
+    state = frappe.db.get_global(f"payment_tracking_recalc:{doctype}:{lane}")
+    return json.loads(state) if state else {}
+
+
+def set_lane_state(doctype, lane, state):
+    frappe.db.set_global(f"payment_tracking_recalc:{doctype}:{lane}", json.dumps(state))
+
+
+def rebuild_totals_sql(doctypes=None, notify_user=None):
+    """
+    Rebuild custom_total_payment with one set-based UPDATE per doctype,
+    committing after each doctype.
+
+    Returns {doctype: {"documents": n, "updated": rows changed}}.
+    """
+    summary = {}
+
+    for doctype in doctypes or TOTAL_PAYMENT_DOCTYPES:
+        if doctype not in TOTAL_PAYMENT_DOCTYPES:
+            frappe.throw(_("Payment totals are not tracked for {0}").format(doctype))
+
+        updated = retry_on_deadlock("rebuild_totals_sql", rebuild_doctype_totals_sql, doctype)
+
+        summary[doctype] = {"documents": frappe.db.count(doctype), "updated": updated}
+
+    if notify_user:
+        frappe.publish_realtime(REBUILD_DONE_EVENT, summary, user=notify_user)
+
+    return summary
+
+
+def rebuild_doctype_totals_sql(doctype):
+    """One set-based UPDATE for a doctype, committed; returns the number of rows changed"""
+    params = {}
+    payments_query = get_payments_query(doctype, params)
+
+    frappe.db.sql(f"""
+        UPDATE `tab{doctype}` doc
+        LEFT JOIN (
+            SELECT payments.docname, SUM(payments.allocated_amount) AS total
+            FROM ({payments_query}) payments
+            GROUP BY payments.docname
+        ) totals ON totals.docname = doc.name
+        SET doc.custom_total_payment = IFNULL(totals.total, 0)
+    """, params)
+    updated = frappe.db.sql("SELECT ROW_COUNT()")[0][0]
+    frappe.db.commit()
+
+    return updated
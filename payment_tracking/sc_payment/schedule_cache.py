@@ -0,0 +1,99 @@
+"""
+Request/transaction-scoped Payment Schedule cache
+
+Several hooks of one Payment Entry or Purchase Invoice save read the same
+`tabPayment Schedule` rows. get_schedule_rows() fetches each parent's rows at
+most once per transaction (one query for all missing parents) and serves
+later reads from memory.
+
+The cache is dropped on commit and rollback, and this app invalidates the
+parents it writes to. Returned rows are shared: treat them as read-only.
+
+Hits and misses are counted as `schedule_cache_hits` / `schedule_cache_misses`
+(see payment_tracking.sc_payment.metrics).
+"""
+
+import frappe
+
+from payment_tracking.sc_payment import metrics
+from payment_tracking.sc_payment.instrumentation import instrumented
+
+SCHEDULE_FIELDS = [
+    "name",
+    "parent",
+    "parenttype",
+    "idx",
+    "payment_term",
+    "due_date",
+    "payment_amount",
+    "base_payment_amount",
+    "paid_amount",
+    "outstanding",
+    "discount",
+    "discount_type",
+    "custom_invoice_doctype",
+    "custom_invoice_name",
+]
+
+
+def get_schedule_rows(parents):
+    """Return {parent: [Payment Schedule rows ordered by idx]} for the given parents"""
+    cache = _get_cache()
+    parents = {parent for parent in parents if parent}
+    missing = [parent for parent in parents if parent not in cache]
+
+    metrics.incr("schedule_cache_hits", len(parents) - len(missing))
+    metrics.incr("schedule_cache_misses", len(missing))
+
+    if missing:
+        for parent in missing:
+            cache[parent] = []
+
+        for row in frappe.get_all(
+            "Payment Schedule",
+            filters={"parent": ["in", missing]},
+            fields=SCHEDULE_FIELDS,
+            order_by="idx asc",
+        ):
+            cache[row.parent].append(row)
+
+    return {parent: cache[parent] for parent in parents}
+
+
+def get_schedule(parent):
+    """Return the Payment Schedule rows of one parent ordered by idx"""
+    return get_schedule_rows([parent]).get(parent, [])
+
+
+def invalidate_schedule(parents=None):
+    """Forget cached rows of the given parents (all parents if None)"""
+    cache = getattr(frappe.local, "payment_tracking_schedule_cache", None)
+    if not cache:
+        return
+
+    if parents is None:
+        cache.clear()
+        return
+
+    for parent in parents:
+        cache.pop(parent, None)
+
+
+@instrumented
+def invalidate_document_schedule(doc, method=None):
+    """Order on_update / on_update_after_submit: the saved schedule replaces cached rows"""
+    invalidate_schedule([doc.name])
+
+
+def clear_schedule_cache():
+    frappe.local.payment_tracking_schedule_cache = None
+
+
+def _get_cache():
+    cache = getattr(frappe.local, "payment_tracking_schedule_cache", None)
+    if cache is None:
+        cache = frappe.local.payment_tracking_schedule_cache = {}
+        frappe.db.after_commit.add(clear_schedule_cache)
+        frappe.db.after_rollback.add(clear_schedule_cache)
+
+    return cache
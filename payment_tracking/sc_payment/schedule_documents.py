@@ -0,0 +1,173 @@
+"""
+Create a Payment Request or Invoice from one Order Payment Schedule row
+
+create_from_schedule_row() validates, creates and links in one request and
+one transaction. The Order row and the schedule row are locked with
+SELECT ... FOR UPDATE before validating, so two users clicking "+" on the
+same Order at the same time are serialized: the second one sees the first
+one's link (and Payment Request total) and is rejected.
+"""
+
+import frappe
+from frappe import _
+from frappe.utils import flt
+
+from payment_tracking.sc_payment import order_locks
+from payment_tracking.sc_payment.payment_request_availability import check_payment_request_amount
+from payment_tracking.sc_payment.schedule_links import link_schedule_row
+
+# Order doctype -> settings for documents created from its schedule
+SCHEDULE_DOCUMENT_MAP = {
+    "Purchase Order": frappe._dict(
+        party_type="Supplier",
+        party_field="supplier",
+        payment_request_type="Outward",
+        invoice_doctype="Purchase Invoice",
+        make_invoice="erpnext.buying.doctype.purchase_order.purchase_order.make_purchase_invoice",
+    ),
+    "Sales Order": frappe._dict(
+        party_type="Customer",
+        party_field="customer",
+        payment_request_type="Inward",
+        invoice_doctype="Sales Invoice",
+        make_invoice="erpnext.selling.doctype.sales_order.sales_order.make_sales_invoice",
+    ),
+}
+
+
+def create_from_schedule_row(order_doctype, order_name, row_idx, submit=False):
+    """
+    Create a draft Payment Request (advance rows) or Invoice (last row) for
+    the schedule row at row_idx and link the row to it. With submit, the new
+    Payment Request is submitted right away (without emailing the party), so
+    it counts towards the Order's requested amount for the next row.
+
+    Returns {"doctype": ..., "name": ...} of the new document; validation
+    and permission failures (create on the new document's doctype) throw and
+    roll the whole transaction back.
+    """
+    settings = SCHEDULE_DOCUMENT_MAP.get(order_doctype)
+    if not settings:
+        frappe.throw(_("Documents from schedule are not supported for {0}").format(order_doctype))
+
+    row_idx = frappe.utils.cint(row_idx)
+    order = lock_order(order_doctype, order_name, settings)
+    row, last_idx = lock_schedule_row(order_doctype, order_name, row_idx)
+
+    if order.docstatus == 2:
+        frappe.throw(_("You can't create invoice against cancelled document"))
+
+    if row.custom_invoice_name:
+        frappe.throw(_("Invoice for this advance payment already exists: {0}").format(row.custom_invoice_name))
+
+    if row_idx == last_idx:
+        if order.docstatus != 1:
+            frappe.throw(
+                _("{0} must be submitted before creating {1}").format(_(order_doctype), _(settings.invoice_doctype))
+            )
+        frappe.has_permission(settings.invoice_doctype, "create", throw=True)
+        doc = make_invoice(order_name, row, settings)
+    else:
+        available = flt(order.rounded_total or order.grand_total) - flt(order.advance_paid)
+        requested = flt(order.custom_payment_requested_amount)
+        result = check_payment_request_amount(
+            frappe._dict(available=available, requested=requested, remaining=available - requested),
+            row.payment_amount,
+        )
+        if not result["can_create"]:
+            frappe.throw(result["error_message"])
+
+        frappe.has_permission("Payment Request", "submit" if submit else "create", throw=True)
+        doc = make_payment_request(order_doctype, order, row, settings, submit=submit)
+
+    link_schedule_row(order_doctype, order_name, doc.doctype, doc.name, idx=row_idx)
+
+    return {"doctype": doc.doctype, "name": doc.name}
+
+
+def lock_order(order_doctype, order_name, settings):
+    order_locks.lock_order(order_doctype, order_name)
+
+    rows = frappe.db.sql(f"""
+        SELECT name, docstatus, company, currency, `{settings.party_field}` AS party,
+            rounded_total, grand_total, advance_paid, custom_payment_requested_amount
+        FROM `tab{order_doctype}`
+        WHERE name = %(name)s
+        FOR UPDATE
+    """, {"name": order_name}, as_dict=True)
+
+    if not rows:
+        frappe.throw(_("{0} {1} not found").format(_(order_doctype), order_name), frappe.DoesNotExistError)
+
+    return rows[0]
+
+
+def lock_schedule_row(order_doctype, order_name, row_idx):
+    """Lock the schedule row at row_idx; returns (row, idx of the last row)"""
+    params = {"parent": order_name, "parenttype": order_doctype, "idx": row_idx}
+
+    rows = frappe.db.sql("""
+        SELECT name, idx, payment_term, payment_amount, due_date, custom_invoice_doctype, custom_invoice_name
+        FROM `tabPayment Schedule`
+        WHERE parent = %(parent)s AND parenttype = %(parenttype)s AND parentfield = 'payment_schedule'
+            AND idx = %(idx)s
+        FOR UPDATE
+    """, params, as_dict=True)
+
+    if not rows:
+        frappe.throw(_("Payment Schedule row {0} not found in {1}").format(row_idx, order_name))
+
+    last_idx = frappe.db.sql("""
+        SELECT MAX(idx)
+        FROM `tabPayment Schedule`
+        WHERE parent = %(parent)s AND parenttype = %(parenttype)s AND parentfield = 'payment_schedule'
+    """, params)[0][0]
+
+    return rows[0], last_idx
+
+
+def make_payment_request(order_doctype, order, row, settings, submit=False):
+    """Insert a draft (or submitted) Payment Request for an advance schedule row"""
+    payment_request = frappe.new_doc("Payment Request")
+    payment_request.update({
+        "payment_request_type": settings.payment_request_type,
+        "party_type": settings.party_type,
+        "party": order.party,
+        "currency": order.currency,
+        "company": order.company,
+        "reference_doctype": order_doctype,
+        "reference_name": order.name,
+        "grand_total": row.payment_amount,
+        "payment_term_pos": row.idx,
+        "payment_term": row.payment_term,
+        "due_date": row.due_date,
+        "custom_due_date": row.due_date,
+    })
+
+    payment_request.flags.payment_tracking_schedule_linked = True
+    payment_request.insert()
+
+    if submit:
+        payment_request.mute_email = 1
+        payment_request.submit()
+
+    return payment_request
+
+
+def make_invoice(order_name, row, settings):
+    """Insert a draft Invoice for the last schedule row with ERPNext's mapper"""
+    # make_*_invoice take no args parameter: like make_mapped_doc (the client's
+    # open_mapped_doc route), pass them through frappe.flags.args
+    frappe.flags.args = frappe._dict(ignore_pricing_rule=1)
+    try:
+        invoice = frappe.get_attr(settings.make_invoice)(order_name)
+    finally:
+        frappe.flags.args = None
+
+    if row.due_date:
+        invoice.due_date = row.due_date
+
+    invoice.flags.payment_tracking_schedule_linked = True
+    invoice.insert()
+
+    return invoice
@@ -0,0 +1,165 @@
+"""
+Payment Schedule row links (custom_invoice_doctype / custom_invoice_name)
+
+Links are written straight to `tabPayment Schedule`, under the Order's
+advisory lock (see order_locks.py) and locking only the target row with
+SELECT ... FOR UPDATE, instead of loading and saving the whole Order
+(controller validation, version diff and a rewrite of every child table).
+The Order's `modified` is left untouched, like the unlink path always did.
+"""
+
+import frappe
+from frappe import _
+
+from payment_tracking.sc_payment.order_invoice_links import (
+    INVOICE_ORDER_MAP,
+    ORDER_INVOICE_MAP,
+    get_orders_for_invoices,
+)
+from payment_tracking.sc_payment.order_locks import lock_order, lock_orders
+from payment_tracking.sc_payment.schedule_cache import invalidate_schedule
+
+
+def link_schedule_row(order_doctype, order_name, link_doctype, link_name, idx=None, only_if_empty=False):
+    """
+    Point one schedule row of an Order at a Payment Request or Invoice.
+
+    idx selects the row; None selects the last row. With only_if_empty a row
+    that already links to another document is left alone. Linking a row to
+    the document it already points at is a no-op.
+    Returns the linked row's idx, or None if the row is missing or taken.
+    """
+    lock_order(order_doctype, order_name)
+
+    if idx is None:
+        row_condition = "ORDER BY idx DESC LIMIT 1"
+        params = {}
+    else:
+        row_condition = "AND idx = %(idx)s"
+        params = {"idx": idx}
+
+    rows = frappe.db.sql(f"""
+        SELECT name, idx, custom_invoice_doctype, custom_invoice_name
+        FROM `tabPayment Schedule`
+        WHERE parent = %(parent)s AND parenttype = %(parenttype)s AND parentfield = 'payment_schedule'
+        {row_condition}
+        FOR UPDATE
+    """, {"parent": order_name, "parenttype": order_doctype, **params}, as_dict=True)
+
+    if not rows:
+        return None
+
+    row = rows[0]
+    if row.custom_invoice_doctype == link_doctype and row.custom_invoice_name == link_name:
+        return row.idx
+
+    if only_if_empty and row.custom_invoice_name:
+        return None
+
+    frappe.db.sql("""
+        UPDATE `tabPayment Schedule`
+        SET custom_invoice_doctype = %(link_doctype)s, custom_invoice_name = %(link_name)s
+        WHERE name = %(name)s
+    """, {"link_doctype": link_doctype, "link_name": link_name, "name": row.name})
+
+    invalidate_schedule([order_name])
+    return row.idx
+
+
+def unlink_schedule_rows(order_doctype, order_names, link_doctype, link_names):
+    """
+    Clear the links of the given Payment Requests / Invoices from the schedules
+    of the given Orders with one UPDATE. Returns the number of rows cleared.
+    """
+    order_names = tuple(set(filter(None, order_names)))
+    link_names = tuple(set(filter(None, link_names)))
+    if not order_names or not link_names:
+        return 0
+
+    lock_orders((order_doctype, order_name) for order_name in order_names)
+
+    frappe.db.sql("""
+        UPDATE `tabPayment Schedule`
+        SET custom_invoice_doctype = '', custom_invoice_name = ''
+        WHERE parent IN %(parents)s
+            AND parenttype = %(parenttype)s
+            AND custom_invoice_doctype = %(link_doctype)s
+            AND custom_invoice_name IN %(link_names)s
+    """, {
+        "parents": order_names,
+        "parenttype": order_doctype,
+        "link_doctype": link_doctype,
+        "link_names": link_names,
+    })
+    cleared = frappe.db.sql("SELECT ROW_COUNT()")[0][0]
+
+    invalidate_schedule(order_names)
+    return cleared
+
+
+def bulk_unlink_from_schedule(link_doctype, link_names):
+    """
+    Clear the schedule links of many Payment Requests or Invoices in one pass.
+
+    Parent Orders are resolved first (Payment Request reference, or the Order
+    Invoice Link index for Invoices) so the UPDATE can use the parent index,
+    then rows are cleared with one UPDATE per Order doctype.
+    Returns {order_doctype: {order_name: rows cleared}}.
+    """
+    link_names = list(set(filter(None, link_names)))
+    if not link_names:
+        return {}
+
+    orders_by_doctype = {}
+    if link_doctype == "Payment Request":
+        for request in frappe.get_all(
+            "Payment Request",
+            filters={"name": ["in", link_names], "reference_doctype": ["in", list(ORDER_INVOICE_MAP)]},
+            fields=["reference_doctype", "reference_name"],
+        ):
+            orders_by_doctype.setdefault(request.reference_doctype, set()).add(request.reference_name)
+    elif link_doctype in INVOICE_ORDER_MAP:
+        order_doctype = INVOICE_ORDER_MAP[link_doctype][0]
+        for order_names in get_orders_for_invoices(link_doctype, link_names).values():
+            orders_by_doctype.setdefault(order_doctype, set()).update(order_names)
+    else:
+        frappe.throw(_("Schedule links are not tracked for {0}").format(link_doctype))
+
+    lock_orders(
+        (order_doctype, order_name)
+        for order_doctype, order_names in orders_by_doctype.items()
+        for order_name in order_names
+    )
+
+    summary = {}
+    for order_doctype, order_names in sorted(orders_by_doctype.items()):
+        rows = frappe.db.sql("""
+            SELECT name, parent
+            FROM `tabPayment Schedule`
+            WHERE parent IN %(parents)s
+                AND parenttype = %(parenttype)s
+                AND custom_invoice_doctype = %(link_doctype)s
+                AND custom_invoice_name IN %(link_names)s
+            ORDER BY parent, idx
+            FOR UPDATE
+        """, {
+            "parents": tuple(order_names),
+            "parenttype": order_doctype,
+            "link_doctype": link_doctype,
+            "link_names": tuple(link_names),
+        })
+        if not rows:
+            continue
+
+        frappe.db.sql("""
+            UPDATE `tabPayment Schedule`
+            SET custom_invoice_doctype = '', custom_invoice_name = ''
+            WHERE name IN %(names)s
+        """, {"names": tuple(name for name, _parent in rows)})
+        invalidate_schedule(order_names)
+
+        counts = summary.setdefault(order_doctype, {})
+        for _name, parent in rows:
+            counts[parent] = counts.get(parent, 0) + 1
+
+    return summary
@@ -0,0 +1,171 @@
+from unittest.mock import patch
+
+import frappe
+from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
+from erpnext.buying.doctype.purchase_order.test_purchase_order import create_purchase_order
+from frappe.test_runner import make_test_records
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, flt, nowdate
+
+from payment_tracking.sc_payment import payment_totals
+from payment_tracking.sc_payment.doctype_events.payment_entry import populate_payment_schedule_idx
+from payment_tracking.sc_payment.overrides.payment_entry import apply_payment_schedule_deltas
+from payment_tracking.sc_payment.schedule_cache import invalidate_schedule
+
+TEST_PAYMENT_TERM = "_Test Payment Tracking Installment"
+
+
+class TestPaymentEntry(FrappeTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        make_test_records("Purchase Order")
+
+        if not frappe.db.exists("Payment Term", TEST_PAYMENT_TERM):
+            frappe.get_doc({
+                "doctype": "Payment Term",
+                "payment_term_name": TEST_PAYMENT_TERM,
+                "invoice_portion": 50,
+                "due_date_based_on": "Day(s) after invoice date",
+                "credit_days": 0,
+            }).insert()
+
+    def test_duplicate_payment_terms_get_distinct_rows(self):
+        """References sharing a payment_term take the schedule rows one by one in idx order"""
+        po = make_order_with_duplicate_terms()
+
+        doc = frappe._dict(references=[
+            make_reference(po.name, idx=2),
+            make_reference(po.name),
+            make_reference(po.name),
+        ])
+        populate_payment_schedule_idx(doc)
+
+        # The preset idx is kept; the others skip it
+        self.assertEqual([ref.custom_payment_schedule_idx for ref in doc.references], [2, 1, 3])
+
+        # No free row left: the reference stays unassigned
+        doc.references.append(make_reference(po.name))
+        populate_payment_schedule_idx(doc)
+        self.assertFalse(doc.references[-1].custom_payment_schedule_idx)
+
+    def test_schedule_deltas_are_applied_per_row(self):
+        po = make_order_with_duplicate_terms()
+        rows = get_schedule(po.name)
+
+        apply_payment_schedule_deltas({
+            rows[0].name: [100, 100, 0, -100, -100],
+            rows[2].name: [40, 40, 10, -50, -50],
+        })
+
+        rows = get_schedule(po.name)
+        self.assertEqual([flt(row.paid_amount) for row in rows], [100, 0, 40])
+        self.assertEqual([flt(row.discounted_amount) for row in rows], [0, 0, 10])
+        self.assertEqual([flt(row.outstanding) for row in rows], [400 - 100, 400, 200 - 50])
+
+    def test_submit_and_cancel_round_trip(self):
+        for mode in ("recompute", "incremental", "deferred"):
+            with self.subTest(mode=mode), patch.dict(
+                frappe.local.conf, {"payment_tracking_total_payment_mode": mode}
+            ):
+                po = make_order_with_duplicate_terms()
+                payment_entry = make_payment_entry(po, {1: 300, 3: 200})
+
+                payment_entry.submit()
+                rows = get_schedule(po.name)
+                self.assertEqual([flt(row.paid_amount) for row in rows], [300, 0, 200])
+                self.assertEqual([flt(row.outstanding) for row in rows], [100, 400, 0])
+                self.assertEqual(get_total_payment(po.name), 500)
+
+                payment_entry.cancel()
+                rows = get_schedule(po.name)
+                self.assertEqual([flt(row.paid_amount) for row in rows], [0, 0, 0])
+                self.assertEqual([flt(row.outstanding) for row in rows], [400, 400, 200])
+                self.assertEqual(get_total_payment(po.name), 0)
+
+    def test_over_allocation_of_a_row_is_refused(self):
+        po = make_order_with_duplicate_terms()
+        make_payment_entry(po, {3: 200}).submit()
+
+        payment_entry = make_payment_entry(po, {3: 100})
+        self.assertRaises(frappe.ValidationError, payment_entry.submit)
+
+    def test_deferred_total_repeats_while_payments_arrive(self):
+        po = make_order_with_duplicate_terms()
+        marker = payment_totals.get_dirty_marker_key("Purchase Order", po.name)
+        frappe.cache.set(marker, 1)
+
+        passes = []
+
+        def recompute(documents):
+            passes.append(documents)
+            # A new payment arrives while the first pass runs
+            if len(passes) == 1:
+                frappe.cache.incr(marker)
+
+        with patch.object(payment_totals, "commit_documents_total_payment", side_effect=recompute):
+            payment_totals.recompute_deferred_total("Purchase Order", po.name)
+
+        self.assertEqual(len(passes), 2)
+        self.assertIsNone(frappe.cache.get(marker))
+
+
+def make_order_with_duplicate_terms():
+    """Submitted Purchase Order of 1000 whose schedule repeats one payment term: 400 / 400 / 200"""
+    po = create_purchase_order(qty=10, rate=100, do_not_save=True)
+    po.payment_terms_template = None
+    po.set("payment_schedule", [])
+    for days, portion in ((10, 40), (20, 40), (30, 20)):
+        po.append("payment_schedule", {
+            "payment_term": TEST_PAYMENT_TERM,
+            "due_date": add_days(nowdate(), days),
+            "invoice_portion": portion,
+            "payment_amount": 1000 * portion / 100,
+        })
+    po.insert()
+    po.submit()
+
+    invalidate_schedule([po.name])
+    return po
+
+
+def make_reference(order_name, idx=None):
+    return frappe._dict(
+        reference_doctype="Purchase Order",
+        reference_name=order_name,
+        payment_term=TEST_PAYMENT_TERM,
+        custom_payment_schedule_idx=idx,
+    )
+
+
+def make_payment_entry(po, allocations):
+    """Draft Payment Entry against po allocating {schedule idx: amount}"""
+    payment_entry = get_payment_entry("Purchase Order", po.name, bank_account="_Test Bank - _TC")
+    payment_entry.set("references", [])
+    for idx, amount in allocations.items():
+        payment_entry.append("references", {
+            "reference_doctype": "Purchase Order",
+            "reference_name": po.name,
+            "payment_term": TEST_PAYMENT_TERM,
+            "custom_payment_schedule_idx": idx,
+            "total_amount": po.grand_total,
+            "outstanding_amount": po.grand_total,
+            "allocated_amount": amount,
+        })
+
+    payment_entry.paid_amount = payment_entry.received_amount = sum(allocations.values())
+    payment_entry.insert()
+    return payment_entry
+
+
+def get_schedule(order_name):
+    return frappe.get_all(
+        "Payment Schedule",
+        filters={"parent": order_name, "parenttype": "Purchase Order"},
+        fields=["name", "idx", "paid_amount", "discounted_amount", "outstanding"],
+        order_by="idx asc",
+    )
+
+
+def get_total_payment(order_name):
+    return flt(frappe.db.get_value("Purchase Order", order_name, "custom_total_payment"))